@@ -12,8 +12,9 @@ __all__ = ('anedit', 'anedit_multi', 'main')
 # imports
 from basics import VERSION
 from hilliep import VALID_TYPES
-from normalizer import Dictionary, annotation_fixes
+from normalizer import annotation_fixes
 from pdf import Pdf
+from porter2 import cached_stem
 import os
 import os.path
 import readline
@@ -26,6 +27,7 @@ def anedit_multi(files, options):
     """Edit annotations of mutliple files.
 
     All is printed to standard input or standard error.
+    The word list for suggestions is shared among all files.
 
     Options:
     * options.recursive     Handle directories
@@ -61,16 +63,13 @@ def anedit(path, target, options):
     # FIXME: Who guarantees this method is only executed on valid files?
     # Also check for pusher, hillieo, hilliep, ...
 
-    # wordlist for normalization
-    wordlist = Dictionary()
-
     # open document
     document = Pdf(path, options, pgm=sys.argv[0])
 
     # fetch notes
     notes = []
     for n_annot, item in enumerate(document.annotations(options)):
-        sugg = annotation_fixes(item.note, wordlist, options.verbose)
+        sugg = annotation_fixes(item.note, verbose=options.verbose) # Uses the shared dictionary
         notes.append((item, sugg))
 
     # Walk through notes
@@ -204,5 +203,8 @@ def main():
     # Run highlighter
     anedit_multi(args.paths, args)
 
+    if args.verbose: # Report stem cache usage
+        sys.stderr.write('stem cache: {} hits, {} misses\n'.format(cached_stem.hits, cached_stem.misses))
+
 
 ## EOF ##
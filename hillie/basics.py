@@ -5,9 +5,10 @@ All rights reserved.
 
 """
 # EXPORTS
-__all__ = ('RX_KEY', 'VERSION', 'uniquepath', 'remove_all', 'unique')
+__all__ = ('RX_KEY', 'VERSION', 'uniquepath', 'remove_all', 'unique', 'LRUCache')
 
 # IMPORTS
+from collections import OrderedDict
 import os.path
 import re
 
@@ -39,5 +40,55 @@ def remove_all(lst, item):
 
 unique = lambda s: list(set(s))
 
+class LRUCache(object):
+    """Mapping with at most *maxsize* entries (unbounded if None).
+    The least recently used entries are evicted first. Lookups through
+    get() are counted as hits and misses.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data[key] = value # Mark as most recently used
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        self._evict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def resize(self, maxsize):
+        """Change the capacity, evicting entries if necessary."""
+        self.maxsize = maxsize
+        self._evict()
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 
 ## EOF ##
@@ -0,0 +1,185 @@
+"""Persistent cache of annotations extracted from documents.
+
+The cache is an SQLite database. For each document, it stores the
+embedded title and the raw annotations (type, page number, contents),
+before any filtering. Entries are validated by the document's size and
+modification time and, optionally, a hash of its content. Valid entries
+answer extraction requests without opening the document at all.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('AnnotationCache', 'CACHE_DIR')
+
+# imports
+from basics import uniquepath
+from multiprocessing.util import Finalize
+import hashlib
+import os
+import os.path
+import sqlite3
+
+# config
+CACHE_DIR = '~/.cache/hillie'
+CACHE_FILE = 'annotations.sqlite'
+
+
+## code ##
+
+_connections = {} # (process id, database path) -> connection
+
+def _connect(path):
+    """Return the connection of this process to the database at *path*.
+    It is opened on first use and closed when the process exits.
+    """
+    key = os.getpid(), path
+    conn = _connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=60)
+        conn.text_factory = str
+        conn.execute('PRAGMA journal_mode = WAL') # Concurrent readers and a writer
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                hash TEXT,
+                title TEXT)
+            """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS annotations (
+                path TEXT,
+                type TEXT,
+                page TEXT,
+                contents TEXT)
+            """)
+        conn.execute('CREATE INDEX IF NOT EXISTS annotations_path ON annotations (path)')
+        conn.commit()
+        _connections[key] = conn
+        Finalize(None, _disconnect, args=(path, ), exitpriority=10) # Also run by pool workers
+    return conn
+
+def _disconnect(path):
+    """Close the connection of this process to the database at *path*."""
+    conn = _connections.pop((os.getpid(), path), None)
+    if conn is not None:
+        conn.close()
+
+def _content_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as ifile:
+        for chunk in iter(lambda: ifile.read(1 << 16), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AnnotationCache(object):
+    """Annotation cache stored in *cache_dir*.
+
+    If *use_hash* is set, entries are also validated by the content hash
+    of the document. If *rebuild* is set, all lookups miss, so that every
+    document is extracted again and its entry replaced.
+
+    The cache can be passed to worker processes. Each process opens one
+    connection, shared by all copies of the cache it receives, and closes
+    it when it exits.
+
+    """
+    def __init__(self, cache_dir=CACHE_DIR, use_hash=False, rebuild=False):
+        self.cache_dir = uniquepath(cache_dir)
+        self.use_hash = use_hash
+        self.rebuild = rebuild
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['hits'] = state['misses'] = state['stored'] = 0 # Counted by the receiver
+        return state
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            self._conn = _connect(os.path.join(self.cache_dir, CACHE_FILE))
+        return self._conn
+
+    def lookup(self, path):
+        """Return (title, records) of the document at *path* or None if
+        there's no valid entry. Records are (type, page, contents) tuples.
+        """
+        key = uniquepath(path)
+        row = None
+        if not self.rebuild:
+            row = self.conn.execute(
+                'SELECT size, mtime, hash, title FROM documents WHERE path = ?',
+                (key, )).fetchone()
+
+        if row is None or not self._is_valid(key, *row[:3]):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        records = self.conn.execute(
+            'SELECT type, page, contents FROM annotations WHERE path = ? ORDER BY rowid',
+            (key, )).fetchall()
+        return row[3], records
+
+    def store(self, path, title, records):
+        """Store *title* and *records* of the document at *path*."""
+        key = uniquepath(path)
+        st = os.stat(key)
+        digest = self.use_hash and _content_hash(key) or None
+        with self.conn: # Transaction
+            self.conn.execute('DELETE FROM annotations WHERE path = ?', (key, ))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO documents (path, size, mtime, hash, title) VALUES (?, ?, ?, ?, ?)',
+                (key, st.st_size, st.st_mtime, digest, title))
+            self.conn.executemany(
+                'INSERT INTO annotations (path, type, page, contents) VALUES (?, ?, ?, ?)',
+                [(key, type_, page, contents) for type_, page, contents in records])
+        self.stored += 1
+
+    def _is_valid(self, path, size, mtime, digest):
+        try:
+            st = os.stat(path)
+        except OSError: # Document is gone
+            return False
+
+        if st.st_size != size or st.st_mtime != mtime:
+            return False
+        if self.use_hash and digest != _content_hash(path):
+            return False
+        return True
+
+    def counters(self):
+        """Return and reset the (hits, misses, stored) counters."""
+        counts = self.hits, self.misses, self.stored
+        self.hits = self.misses = self.stored = 0
+        return counts
+
+    def add_counters(self, (hits, misses, stored)):
+        """Add counters returned by counters() (e.g. from a worker process)."""
+        self.hits += hits
+        self.misses += misses
+        self.stored += stored
+
+    def stats(self):
+        """Return a summary of the counters and the cache size."""
+        docs = self.conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        annots = self.conn.execute('SELECT COUNT(*) FROM annotations').fetchone()[0]
+        return 'cache: {} hits, {} misses, {} stored; {} documents, {} annotations in {}'.format(
+            self.hits, self.misses, self.stored, docs, annots, os.path.join(self.cache_dir, CACHE_FILE))
+
+    def close(self):
+        if self._conn is not None:
+            _disconnect(os.path.join(self.cache_dir, CACHE_FILE))
+            self._conn = None
+
+## EOF ##
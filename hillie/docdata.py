@@ -0,0 +1,138 @@
+"""Index of Okular's annotation (docdata) files.
+
+Okular stores the annotations of a document in its docdata directory,
+in a file named "<size>.<filename>.xml". The name goes stale if the
+document changes, but the file's header still records the document's
+location (<documentInfo url="...">). The index maps both the locations
+and the (size, filename) pairs to docdata files.
+
+The index is stored in the cache directory. It is refreshed when the
+docdata directory's modification time changes; only new or modified
+files are read again, and only up to their header.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('DocdataIndex', )
+
+# imports
+from basics import uniquepath
+from cache import CACHE_DIR
+from lxml import etree
+from shared import list_dir
+import hashlib
+import json
+import os
+import os.path
+import re
+import tempfile
+import urllib
+
+# config
+INDEX_FILE = 'docdata-{}.json'
+RX_DOCDATA = re.compile('^(\d+)\.(.*)\.xml$')
+
+
+## code ##
+
+def _document_url(path):
+    """Return the document location from the header of the docdata file
+    at *path* or None if there's none.
+    """
+    url = None
+    try:
+        for event, elem in etree.iterparse(path, events=('start', )):
+            url = elem.get('url') # First element is documentInfo
+            break
+    except (IOError, etree.XMLSyntaxError):
+        return None
+
+    if url is None or url == '':
+        return None
+    if isinstance(url, unicode): # Paths are byte strings, as in the stored index
+        url = url.encode('utf-8')
+    if url.startswith('file://'):
+        url = urllib.url2pathname(url[len('file://'):])
+    return os.path.normpath(url)
+
+class DocdataIndex(object):
+    """Index of the docdata files in directory *okular*.
+    """
+    def __init__(self, okular, cache_dir=CACHE_DIR):
+        self.okular = uniquepath(okular)
+        self.path = os.path.join(uniquepath(cache_dir),
+            INDEX_FILE.format(hashlib.sha1(self.okular).hexdigest()[:16]))
+        self.mtime = None
+        self.entries = {} # name -> (mtime, url)
+        self.modified = False
+
+        if os.path.exists(self.path):
+            with open(self.path) as ifile:
+                data = json.load(ifile)
+            self.mtime = data['mtime']
+            self.entries = dict((name.encode('utf-8'), (mtime, url is not None and url.encode('utf-8') or None))
+                                for name, (mtime, url) in data['entries'].iteritems())
+
+        self.refresh()
+
+    def refresh(self):
+        """Update the index if the docdata directory changed."""
+        mtime = os.stat(self.okular).st_mtime
+        if mtime != self.mtime:
+            entries = {}
+            for name, path, is_dir in list_dir(self.okular):
+                if is_dir or not name.endswith('.xml'):
+                    continue
+
+                fmtime = os.stat(path).st_mtime
+                entry = self.entries.get(name)
+                if entry is None or entry[0] != fmtime: # New or modified
+                    entry = fmtime, _document_url(path)
+                entries[name] = entry
+
+            self.entries, self.mtime, self.modified = entries, mtime, True
+
+        # Lookup tables; Okular leaves the files of earlier document sizes
+        # behind, so the newest file of a location wins
+        self._by_url = {}
+        self._by_name = {}
+        newest = {}
+        for name, (fmtime, url) in self.entries.iteritems():
+            if url is not None and (url not in newest or fmtime > newest[url]):
+                newest[url] = fmtime
+                self._by_url[url] = name
+            m = RX_DOCDATA.match(name)
+            if m is not None:
+                self._by_name[m.groups()] = name
+
+    def lookup(self, path):
+        """Return the docdata file of the document at *path* or None if
+        it cannot be found. The file named after the document's current
+        size is preferred over the newest file recorded for its location.
+        """
+        name = self._by_name.get((str(os.stat(path).st_size), os.path.basename(path)))
+        if name is None:
+            name = self._by_url.get(os.path.abspath(path)) or self._by_url.get(uniquepath(path))
+        if name is None:
+            return None
+        return os.path.join(self.okular, name)
+
+    def save(self):
+        """Store the index, if it changed."""
+        if not self.modified:
+            return
+
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # Write to a temporary file first, so readers never see a partial index
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'w') as ofile:
+            json.dump({'mtime': self.mtime, 'entries': self.entries}, ofile)
+        os.rename(tmp, self.path)
+        self.modified = False
+
+## EOF ##
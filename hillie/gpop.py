@@ -55,8 +55,11 @@ Notes:
             [Ignore all the warnings and stuff]
             >>> c.build_dict('collected-words')
 
-        This is done automatically if the files are not found (and can
-        lead to errors if the source directory is not writeable).
+        This is done automatically if the files are not found or older
+        than 'collected-words'. By default, 'anedit' uses precompiled word
+        tables (stems.tbl, words.tbl), which are memory-mapped instead of
+        being read into memory. If the data directory is not writeable,
+        the text lists (stems.t, words.t) are used instead.
 
         Sources:
         * http://dreamsteep.com/projects/the-english-open-word-list.html
@@ -69,18 +72,31 @@ All rights reserved.
 
 """
 # EXPORTS
-__all__ = ('main', 'import_authors', 'import_titles', 'import_keywords', 'import_phrases')
+__all__ = ('main', 'import_authors', 'import_titles', 'import_keywords', 'import_phrases', 'walk_docs', 'batch_docs')
 
 # IMPORTS
+import copy
+import cStringIO
+import hashlib
+import itertools
 import os
 import pydot
 import readline
 import sys
 import tempfile
+import time
 
-from basics import VERSION
+from basics import VERSION, uniquepath
 from graph import Notes, Graph
+from manifest import Manifest
 from normalizer import normalize_name, normalize_title, normalize_keyword
+from shared import parallel_map, walk_files
+
+## CONFIGURATION ##
+
+CHECKPOINT_DOCS = 100
+CHECKPOINT_SECS = 60
+DEFAULT_KEYS = ('author', 'title', 'why', 'what', 'how', 'key', 'ref', 'none')
 
 
 ## CODE ##
@@ -89,10 +105,7 @@ class DontSaveException(Exception): pass
 class PreemtException(Exception): pass
 
 def _bulk_add(graph, reled):
-    for src, dst, key in reled:
-        graph.add_node(src)
-        graph.add_node(dst)
-        graph.add_edge(src, dst, key)
+    graph.add_edges(reled)
 
 def import_authors(args, doc, graph):
     """
@@ -102,9 +115,7 @@ def import_authors(args, doc, graph):
     """
     title = normalize_title(doc.title())
     def add_suggestion(original, main, reled):
-        graph.add_node(main)
-        graph.add_edge(main, title, 'author of')
-        graph.add_edge(title, main, 'authored by')
+        graph.add_edges([(main, title, 'author of'), (title, main, 'authored by')])
         _bulk_add(graph, reled)
 
     queries = [(author, normalize_name(author), []) for author in doc.authors()]
@@ -116,8 +127,7 @@ def import_titles(args, doc, graph):
     2. Add titles as nodes
     """
     def add_suggestion(original, main, reled):
-        graph.add_node(main)
-        graph.add_edge('paper', main, 'is a')
+        graph.add_edges([('paper', main, 'is a')])
         _bulk_add(graph, reled)
 
     title = doc.title()
@@ -167,12 +177,12 @@ def import_keywords(args, doc, graph):
         kws.append((kw, kwn, reled))
 
     def add_suggestion(original, mainkw, reled):
-        graph.add_node(mainkw)
-        graph.add_edge(mainkw, title, ITEM_TITLE)
-        graph.add_edge(title, mainkw, TITLE_ITEM)
-
-        graph.add_edge(KEYWORD, mainkw, KEYWORD_ITEM)
-        graph.add_edge(mainkw, KEYWORD, ITEM_KEYWORD)
+        graph.add_edges([
+            (mainkw, title, ITEM_TITLE),
+            (title, mainkw, TITLE_ITEM),
+            (KEYWORD, mainkw, KEYWORD_ITEM),
+            (mainkw, KEYWORD, ITEM_KEYWORD),
+            ])
 
         _bulk_add(graph, reled)
         #g.add_edge(src, title, ITEM_TITLE) # Don't connect second-level to the title
@@ -314,11 +324,22 @@ def import_phrases(args, doc, graph):
     """
     return True
 
+def import_doc(args, doc, graph):
+    """Import all notes of *doc* selected by *args.filter_keys*."""
+    if 'title' in args.filter_keys:
+        import_titles(args, doc, graph)
+
+    if 'author' in args.filter_keys:
+        import_authors(args, doc, graph)
+
+    if 'key' in args.filter_keys:
+        import_keywords(args, doc, graph)
+
 def walk_docs(args, graph, ifiles):
     """
     """
     if len(args.filter_keys) == 0:
-        args.filter_keys = ('author', 'title', 'why', 'what', 'how', 'key', 'ref', 'none')
+        args.filter_keys = DEFAULT_KEYS
 
     for path in ifiles:
         if os.path.isdir(path):
@@ -330,30 +351,136 @@ def walk_docs(args, graph, ifiles):
         if not os.path.exists(path) or not os.path.isfile(path):
             continue
 
+        signature = None
+        if args.manifest is not None:
+            signature = args.manifest.check(path)
+            if signature is None: # Unchanged since the last run
+                continue
+
         doc = Notes(path)
 
         try:
-            if 'title' in args.filter_keys:
-                import_titles(args, doc, graph)
-
-            if 'author' in args.filter_keys:
-                import_authors(args, doc, graph)
-
-            if 'key' in args.filter_keys:
-                import_keywords(args, doc, graph)
-
+            import_doc(args, doc, graph)
             graph.save()
+            if signature is not None: # Only completely imported documents
+                args.manifest.record(path, signature)
 
         except PreemtException:
             graph.save()
 
         except DontSaveException:
-            pass
+            graph.discard() # Drop this document's changes
+
+class Proposals(object):
+    """Stand-in for a Graph that records nodes and edges, to be applied
+    to the actual graph later (e.g. after being passed from a worker).
+    """
+    def __init__(self):
+        self.nodes, self.edges = [], []
+
+    def add_node(self, label):
+        self.nodes.append(label)
+
+    def add_edge(self, src, dst, key, directed=True):
+        self.edges.append((src, dst, key, directed))
+
+    def add_nodes(self, labels):
+        self.nodes.extend(labels)
+
+    def add_edges(self, edges, directed=True):
+        for src, dst, key in edges:
+            self.add_node(src)
+            self.add_node(dst)
+            self.add_edge(src, dst, key, directed)
+
+    def apply(self, graph):
+        graph.add_nodes(self.nodes)
+        for src, dst, key, directed in self.edges:
+            graph.add_edge(src, dst, key, directed)
+
+def _propose((path, args)):
+    """Extract and normalize the notes of one document (in a worker process).
+    Returns the path, the proposed graph changes, the printed output and
+    an error message (or None).
+    """
+    stdout, sys.stdout = sys.stdout, cStringIO.StringIO()
+    proposals, error = Proposals(), None
+    try:
+        import_doc(args, Notes(path), proposals)
+    except Exception as err:
+        # Report instead of raising; Exceptions that cannot be pickled
+        # would otherwise stall the pool.
+        error = '{}: {}: {}\n'.format(sys.argv[0], path, err.message or type(err).__name__)
+    finally:
+        output, sys.stdout = sys.stdout.getvalue(), stdout
+    return path, proposals, output, error
+
+def batch_docs(args, graph, ifiles):
+    """Import documents without asking, picking the default answer.
+
+    Documents are extracted and normalized in *args.jobs* worker
+    processes, their proposals applied to *graph* as they arrive. The
+    graph is saved every *args.checkpoint_docs* documents or
+    *args.checkpoint_secs* seconds, whatever comes first, and at the end.
+
+    """
+    if len(args.filter_keys) == 0:
+        args.filter_keys = DEFAULT_KEYS
+
+    # Workers get a copy of the options without the manifest
+    wargs = copy.copy(args)
+    wargs.manifest = None
+
+    signatures = {}
+    def jobs():
+        for path in walk_files(ifiles, args.recursive):
+            if not os.path.isfile(path):
+                continue
+
+            signature = None
+            if args.manifest is not None:
+                signature = args.manifest.check(path)
+                if signature is None: # Unchanged since the last run
+                    continue
+
+            signatures[path] = signature
+            yield path, wargs
+
+    if args.jobs > 1:
+        results = parallel_map(_propose, jobs(), args.jobs, ordered=False)
+    else:
+        results = itertools.imap(_propose, jobs())
+
+    pending, last_save = [], time.time()
+    def checkpoint():
+        graph.save()
+        if args.manifest is not None:
+            for path in pending:
+                args.manifest.record(path, signatures[path])
+            args.manifest.save()
+        del pending[:]
+
+    for path, proposals, output, error in results:
+        sys.stdout.write(output)
+        if error is not None:
+            sys.stderr.write(error)
+            continue
+
+        proposals.apply(graph)
+        pending.append(path)
+        if len(pending) >= args.checkpoint_docs or time.time() - last_save >= args.checkpoint_secs:
+            checkpoint()
+            last_save = time.time()
+
+    checkpoint()
 
 def main():
     """Populate a graph from highlighted ares in PDF documents.
 
-    usage: gpop [--help] [--version] [-y] [--batch] [-k FILTER_KEYS] [-r] [-q] ...
+    usage: gpop [--help] [--version] [-y] [--batch] [-k FILTER_KEYS] [-r] [-q]
+                [--changed-only] [-j JOBS] [--checkpoint-docs N]
+                [--checkpoint-secs SECS]
+                ...
 
     Populate a graph from highlighted ares in PDF documents.
 
@@ -369,6 +496,14 @@ def main():
                             Import listed keys. Use "None" for empty/no key
       -r, --recursive       Read all files under each directory, recursively.
       -q, --quiet           Decrease verbosity
+      --changed-only, --since-last-run
+                            Only import documents that changed since the last
+                            run with --changed-only on the same graph.
+      -j JOBS, --jobs JOBS  With --batch, process documents in JOBS parallel
+                            processes.
+      --checkpoint-docs N   With --batch, save the graph every N documents.
+      --checkpoint-secs SECS
+                            With --batch, save the graph every SECS seconds.
 
     """
     import argparse
@@ -383,6 +518,10 @@ def main():
     parser.add_argument('-k', '--key', action='append', dest='filter_keys', default=[], help='Import listed keys. Use "None" for empty/no key')
     parser.add_argument('-r', '--recursive', action='store_true', dest='recursive', default=False, help='Read all files under each directory, recursively.')
     parser.add_argument('-q', '--quiet', action='store_true', dest='quiet', default=False, help='Decrease verbosity')
+    parser.add_argument('--changed-only', '--since-last-run', action='store_true', dest='changed_only', default=False, help='Only import documents that changed since the last run with --changed-only on the same graph.')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs', default=1, help='With --batch, process documents in JOBS parallel processes.')
+    parser.add_argument('--checkpoint-docs', type=int, dest='checkpoint_docs', default=CHECKPOINT_DOCS, metavar='N', help='With --batch, save the graph every N documents.')
+    parser.add_argument('--checkpoint-secs', type=float, dest='checkpoint_secs', default=CHECKPOINT_SECS, metavar='SECS', help='With --batch, save the graph every SECS seconds.')
 
     parser.add_argument('paths', nargs=argparse.REMAINDER, help='List of files or directories to be processed')
     args = parser.parse_args()
@@ -393,7 +532,19 @@ def main():
         gpath = args.paths[-1]
         graph = Graph(gpath)
         ifiles = args.paths[:-1]
-        walk_docs(args, graph, ifiles)
+
+        # Change detection, per graph
+        args.manifest = None
+        if args.changed_only:
+            args.manifest = Manifest('gpop-' + hashlib.sha1(uniquepath(gpath)).hexdigest()[:16])
+
+        if args.batch:
+            batch_docs(args, graph, ifiles)
+        else:
+            walk_docs(args, graph, ifiles)
+
+        if args.manifest is not None:
+            args.manifest.save()
 
     except (Exception) as err:
         msg = '{}: {}: {}\n'.format(sys.argv[0], gpath, err.message)
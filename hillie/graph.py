@@ -13,29 +13,89 @@ __all__ = ('Graph', 'Notes')
 # IMPORTS
 import urllib
 import poppler
-from basics import VALID_TYPES, RX_KEY, uniquepath
+from basics import RX_KEY, uniquepath
+
+## CONFIGURATION ##
+
+VALID_TYPES = ['highlight', 'underline', 'squiggly', 'strike-out']
 
 
 ## CODE ##
 
 class Graph(object):
+    """Graph storage.
+
+    Nodes and edges are staged in memory, without duplicates, and applied
+    to the storage in one go by flush (or save). Staged changes can be
+    dropped with discard. Known edges are cached, so that connected
+    rarely has to query the storage.
+
+    """
     def __init__(self, path):
         from nowhere.shell.notebook import Notebook
         from nowhere.frontend.dummy import Renderer_Dummy
         self.shell = Notebook(Renderer_Dummy(), {})
         self.graph = self.shell.open(path)
+        self._nodes, self._edges = [], []   # Staged, in order
+        self._staged = set()                # Staged nodes and edges
+        self._known_nodes = set()           # Nodes in the storage
+        self._adjacency = {}                # (src, dst, key) -> connected
 
     def add_node(self, label):
-        self.graph.node(label)
+        if label not in self._staged and label not in self._known_nodes:
+            self._staged.add(label)
+            self._nodes.append(label)
 
     def add_edge(self, src, dst, key, directed=True):
-        self.graph.node(dst).node(src).key(key, directed=directed).connect()
+        edge = (src, dst, key, directed)
+        if edge not in self._staged and not self._adjacency.get(edge[:3], False):
+            self._staged.add(edge)
+            self._edges.append(edge)
+
+    def add_nodes(self, labels):
+        for label in labels:
+            self.add_node(label)
+
+    def add_edges(self, edges, directed=True):
+        """Add (src, dst, key) *edges* and the nodes they connect."""
+        for src, dst, key in edges:
+            self.add_node(src)
+            self.add_node(dst)
+            self.add_edge(src, dst, key, directed)
+
+    def flush(self):
+        """Apply the staged nodes and edges to the storage."""
+        for label in self._nodes:
+            self.graph.node(label)
+        self._known_nodes.update(self._nodes)
+
+        for src, dst, key, directed in self._edges:
+            self.graph.node(dst).node(src).key(key, directed=directed).connect()
+            self._adjacency[(src, dst, key)] = True
+            if not directed:
+                self._adjacency[(dst, src, key)] = True
+            self._known_nodes.update((src, dst))
+
+        self.discard()
+
+    def discard(self):
+        """Drop the staged nodes and edges."""
+        self._nodes, self._edges = [], []
+        self._staged = set()
 
     def save(self):
+        self.flush()
         self.graph.save()
 
-    def connected(src, dst, key):
-        return len(self.graph.edges(src=src, dst=dst, key=key)) > 0
+    def connected(self, src, dst, key):
+        staged = self._staged
+        if (src, dst, key, True) in staged or (src, dst, key, False) in staged or (dst, src, key, False) in staged:
+            return True
+
+        edge = (src, dst, key)
+        if edge not in self._adjacency:
+            self._adjacency[edge] = len(self.graph.edges(src=src, dst=dst, key=key)) > 0
+        return self._adjacency[edge]
 
     def __del__(self):
         if self.shell is not None:
@@ -45,11 +105,16 @@ class Graph(object):
                 pass
 
 class Notes(object):
+    """Keyed notes of a PDF document.
+    The document is parsed once, on first access, and its notes are
+    indexed by their xml-style key.
+    """
     def __init__(self, path):
         url = 'file://{}'.format(urllib.pathname2url(uniquepath(path)))
         self.document = poppler.document_new_from_file(url, None)
         self.valid_types = VALID_TYPES
         self.path = path
+        self._notes = None
 
     def authors(self):
         return self._walk_document('author')
@@ -73,6 +138,13 @@ class Notes(object):
         return self._walk_document('ref')
 
     def _walk_document(self, key):
+        if self._notes is None:
+            self._notes = self._index_document()
+        return iter(self._notes.get(key, ()))
+
+    def _index_document(self):
+        """Return a map from keys to the notes with that key, in document order."""
+        notes = {}
         for i in range(self.document.get_n_pages()):
             for annot_mapping in self.document.get_page(i).get_annot_mapping():
                 annot = annot_mapping.annot
@@ -80,7 +152,9 @@ class Notes(object):
                 annot_type = annot_type[0].upper() + annot_type[1:]
                 if annot_type.lower() in self.valid_types:
 
-                    note = annot.get_contents().strip()
+                    note = annot.get_contents()
+                    if note is None: continue
+                    note = note.strip()
 
                     m = RX_KEY.match(note)
                     if m is not None:
@@ -88,7 +162,9 @@ class Notes(object):
                     else:
                         ekey, note = None, note
 
-                    if key == ekey and note is not None and note != '':
-                        yield note
+                    if note is not None and note != '':
+                        notes.setdefault(ekey, []).append(note)
+
+        return notes
 
 ## EOF ##
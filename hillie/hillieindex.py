@@ -0,0 +1,138 @@
+"""Index notes in PDF files.
+
+Written by Matthias Baumgartner, 2018
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('index_files', 'main')
+
+# imports
+from basics import VERSION
+from cache import AnnotationCache, CACHE_DIR
+from index import AnnotationIndex, INDEX_FILE, split_key
+from pdf import open_pdf
+from shared import walk_files
+import glib
+import os.path
+import sys
+
+# config
+VALID_TYPES = ['highlight', 'underline', 'squiggly', 'strike-out'] # Free-hand pop-up notes have type 'text'
+
+## code ##
+
+def index_files(index, files, options):
+    """Add notes from PDF files to *index*.
+    Documents that did not change since they were last indexed are skipped.
+    Returns the number of (re-)indexed documents.
+
+    Options:
+    * options.recursive     Handle directories
+    * options.valid_types   PDF annotation types to process
+    * options.cache         Annotation cache (or None)
+    * options.verbose       Print indexed files
+    * options.stderr        Error stream
+
+    """
+    count = 0
+    valid_types = frozenset(options.valid_types)
+    for path in walk_files(files, options.recursive):
+        try:
+            if index.is_current(path):
+                continue
+
+            document = open_pdf(path, options, pgm=sys.argv[0])
+            title, records = document.records()
+        except (OSError, glib.GError) as err:
+            msg = getattr(err, 'strerror', None) or getattr(err, 'message', err)
+            options.stderr.write('{}: {}: {}\n'.format(sys.argv[0], path, msg))
+            continue
+
+        if title is None or title == '': # Pick filename w/o extension instead
+            title = os.path.splitext(os.path.basename(path))[0]
+
+        notes = []
+        for annot_type, page_no, note in records:
+            if annot_type in valid_types: # Type nicks are lower case
+                key, note = split_key(note.strip())
+                if note != '':
+                    notes.append((page_no, key, note))
+
+        index.add(path, title, notes)
+        count += 1
+        if options.verbose:
+            options.stderr.write('{}: {} notes\n'.format(path, len(notes)))
+
+    return count
+
+def main():
+    """Index highlighted areas from PDF documents.
+
+    usage: hillie-index [--help] [--version] [-r] [-v]
+                        [--annotation-type VALID_TYPES] [--index INDEX]
+                        [--no-prune] [--no-cache] [--cache-dir CACHE_DIR]
+                        ...
+
+    Index highlighted areas from PDF documents, for hillie-search.
+
+    positional arguments:
+      paths
+
+    optional arguments:
+      --help                show this help message and exit
+      --version             show program's version number and exit
+      -r, --recursive       Read all files under each directory, recursively.
+      -v, --verbose         Print the indexed files.
+      --annotation-type VALID_TYPES
+                            Indexed annotation types
+      --index INDEX         Index file.
+      --no-prune            Keep documents that no longer exist in the index.
+      --no-cache            Do not use the annotation cache.
+      --cache-dir CACHE_DIR
+                            Annotation cache directory.
+
+    """
+    import argparse
+
+    usage = """Index highlighted areas from PDF documents, for hillie-search."""
+    parser = argparse.ArgumentParser(description=usage, add_help=False)
+
+    parser.add_argument('--help', action='help', help='show this help message and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s {}'.format(VERSION))
+    parser.add_argument('-r', '--recursive', action='store_true', dest='recursive', default=False, help='Read all files under each directory, recursively.')
+    parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False, help='Print the indexed files.')
+    parser.add_argument('--annotation-type', action='append', dest='valid_types', default=[], help='Indexed annotation types')
+    parser.add_argument('--index', dest='index', default=INDEX_FILE, help='Index file.')
+    parser.add_argument('--no-prune', action='store_false', dest='prune', default=True, help='Keep documents that no longer exist in the index.')
+    parser.add_argument('--no-cache', action='store_false', dest='use_cache', default=True, help='Do not use the annotation cache.')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=CACHE_DIR, help='Annotation cache directory.')
+
+    parser.add_argument('paths', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    if len(args.valid_types) == 0: # Default annotation types if none given.
+        args.valid_types = VALID_TYPES
+    args.valid_types = reduce(list.__add__, [map(str.lower, map(str.strip, arg.split(','))) for arg in args.valid_types], [])
+
+    # Annotation cache
+    args.cache = None
+    if args.use_cache:
+        args.cache = AnnotationCache(args.cache_dir)
+
+    # Run indexer
+    args.stdout = sys.stdout
+    args.stderr = sys.stderr
+    index = AnnotationIndex(args.index)
+    count = index_files(index, args.paths, args)
+    pruned = args.prune and index.prune() or 0
+    if args.verbose:
+        args.stderr.write('{} documents indexed, {} removed\n'.format(count, pruned))
+
+    index.close()
+    if args.cache is not None:
+        args.cache.close()
+
+## EOF ##
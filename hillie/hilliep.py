@@ -14,8 +14,12 @@ __all__ = ('highlights', 'main')
 
 # imports
 from basics import VERSION
-from pdf import Pdf
-from shared import list_keys, print_note
+from cache import AnnotationCache, CACHE_DIR
+from pdf import open_pdf
+from manifest import Manifest
+from shared import changed_files, list_keys, note_record, print_parallel
+from sink import BrokenPipe, OutputSink, BUFFER_SIZE
+from writers import FORMATS, make_writer
 import os.path
 import sys
 
@@ -39,17 +43,20 @@ def highlights(files, options):
     * options.with_page     Print the page number with each line
     * options.buffered      Buffer output
     * options.list_keys     Print key only
-    * options.stdout        Output stream
+    * options.writer        Output format (see writers)
+    * options.jobs          Number of worker processes
+    * options.ordered       Print documents in input order (with jobs > 1)
+    * options.manifest      Only print documents changed since the last run (or None)
+    * options.cache         Annotation cache (or None)
+    * options.stdout        Output sink (see sink.OutputSink)
     * options.stderr        Error stream
 
     """
-    for path in files:
-        if os.path.isdir(path):
-            if options.recursive:
-                highlights([os.path.join(path, p) for p in os.listdir(path)], options)
-            continue # Omit directories
+    if options.jobs > 1:
+        return print_parallel(open_pdf, files, options)
 
-        document = Pdf(path, options, pgm=sys.argv[0])
+    for path, signature in changed_files(files, options):
+        document = open_pdf(path, options, pgm=sys.argv[0])
 
         if options.list_keys:
             options.remove_key = False
@@ -57,7 +64,12 @@ def highlights(files, options):
                 list_keys(item.note, options)
         else:
             for item in document.annotations(options):
-                print_note(item.note, item.page, options)
+                options.writer.write(note_record(item))
+
+        options.stdout.tick() # Don't hold back notes while parsing the next document
+
+        if options.manifest is not None and not document.failed: # Retry failed documents next time
+            options.manifest.record(path, signature)
 
 
 def main():
@@ -65,7 +77,10 @@ def main():
 
     usage: hillie-p [--help] [--version] [-h] [-H] [-b] [-n] [-s] [-t]
                     [-k FILTER_KEYS] [-r] [--annotation-type VALID_TYPES]
-                    [--list-keys] [--line-buffered]
+                    [--list-keys] [--format {text,jsonl,tsv,null}]
+                    [--line-buffered] [-j JOBS] [--unordered]
+                    [--changed-only] [--no-cache] [--rebuild-cache]
+                    [--cache-dir CACHE_DIR] [--cache-hash] [--cache-stats]
                     ...
 
     Print highlighted areas from PDF documents.
@@ -91,9 +106,26 @@ def main():
       --annotation-type VALID_TYPES
                             Extracted annotation types
       --list-keys           Print a list of all keys in the document. Does not
-                            print notes.
+                            print notes. Only with the text format.
+      --format {text,jsonl,tsv,null}
+                            Output format. Records of the jsonl, tsv and null
+                            formats have the fields path, title, page, key,
+                            type and note.
       --line-buffered       Use line buffering on output. This can cause a
                             performance penalty.
+      -j JOBS, --jobs JOBS  Parse documents in JOBS parallel processes.
+      --unordered           With --jobs, print documents as they are completed
+                            instead of in input order.
+      --changed-only, --since-last-run
+                            Only print documents that changed since the last run
+                            with --changed-only.
+      --no-cache            Do not use the annotation cache.
+      --rebuild-cache       Extract all documents again and replace their cache
+                            entries.
+      --cache-dir CACHE_DIR
+                            Annotation cache directory.
+      --cache-hash          Also validate cache entries by content hash.
+      --cache-stats         Print cache statistics to stderr.
 
     """
     import argparse
@@ -112,11 +144,22 @@ def main():
     parser.add_argument('-k', '--key', action='append', dest='filter_keys', default=[], help='Show only listed keys. Use "None" for empty/no key')
     parser.add_argument('-r', '--recursive', action='store_true', dest='recursive', default=False, help='Read all files under each directory, recursively.')
     parser.add_argument('--annotation-type', action='append', dest='valid_types', default=[], help='Extracted annotation types')
-    parser.add_argument('--list-keys', action='store_true', dest='list_keys', default=False, help='Print a list of all keys in the document. Does not print notes.')
+    parser.add_argument('--list-keys', action='store_true', dest='list_keys', default=False, help='Print a list of all keys in the document. Does not print notes. Only with the text format.')
+    parser.add_argument('--format', choices=FORMATS.keys(), dest='format', default='text', help='Output format. Records of the jsonl, tsv and null formats have the fields path, title, page, key, type and note.')
     parser.add_argument('--line-buffered', action='store_false', dest='buffered', default=True, help='Use line buffering on output. This can cause a performance penalty.')
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs', default=1, help='Parse documents in JOBS parallel processes.')
+    parser.add_argument('--unordered', action='store_false', dest='ordered', default=True, help='With --jobs, print documents as they are completed instead of in input order.')
+    parser.add_argument('--changed-only', '--since-last-run', action='store_true', dest='changed_only', default=False, help='Only print documents that changed since the last run with --changed-only.')
+    parser.add_argument('--no-cache', action='store_false', dest='use_cache', default=True, help='Do not use the annotation cache.')
+    parser.add_argument('--rebuild-cache', action='store_true', dest='rebuild_cache', default=False, help='Extract all documents again and replace their cache entries.')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=CACHE_DIR, help='Annotation cache directory.')
+    parser.add_argument('--cache-hash', action='store_true', dest='cache_hash', default=False, help='Also validate cache entries by content hash.')
+    parser.add_argument('--cache-stats', action='store_true', dest='cache_stats', default=False, help='Print cache statistics to stderr.')
 
     parser.add_argument('paths', nargs=argparse.REMAINDER)
     args = parser.parse_args()
+    if args.list_keys and args.format != 'text': # Keys are no note records
+        parser.error('argument --list-keys: not allowed with --format {}'.format(args.format))
     if args.with_path is None: # with_path default depends on number of files given
         args.with_path = len(args.paths) > 1
 
@@ -127,9 +170,31 @@ def main():
     args.filter_keys = reduce(list.__add__, [map(str.lower, map(str.strip, arg.split(','))) for arg in args.filter_keys], [])
     args.valid_types = reduce(list.__add__, [map(str.lower, map(str.strip, arg.split(','))) for arg in args.valid_types], [])
 
+    # Annotation cache
+    args.cache = None
+    if args.use_cache:
+        args.cache = AnnotationCache(args.cache_dir, use_hash=args.cache_hash, rebuild=args.rebuild_cache)
+
+    # Change detection
+    args.manifest = args.changed_only and Manifest('hillie-p') or None
+
     # Run highlighter
-    args.stdout = sys.stdout
+    interactive = sys.stdout.isatty() # Line buffering, as for the terminal
+    args.stdout = OutputSink(sys.stdout, args.buffered and not interactive and BUFFER_SIZE or 0)
     args.stderr = sys.stderr
-    highlights(args.paths, args)
+    args.writer = make_writer(args)
+    try:
+        highlights(args.paths, args)
+        args.writer.close()
+    except BrokenPipe: # Output was closed, e.g. by head
+        args.manifest = None # Not all documents were printed
+
+    if args.manifest is not None:
+        args.manifest.save()
+
+    if args.cache is not None:
+        if args.cache_stats:
+            args.stderr.write(args.cache.stats() + '\n')
+        args.cache.close()
 
 ## EOF ##
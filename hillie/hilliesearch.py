@@ -0,0 +1,113 @@
+"""Search notes in the annotation index.
+
+Written by Matthias Baumgartner, 2018
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('search', 'main')
+
+# imports
+from basics import VERSION
+from index import AnnotationIndex, INDEX_FILE
+from shared import print_note
+from sink import BrokenPipe, OutputSink, BUFFER_SIZE
+import os.path
+import sys
+
+
+## code ##
+
+def search(index, query, options):
+    """Print notes from *index* that match all terms of *query*.
+
+    Options:
+    * options.filter_keys   Only print stated keys.
+    * options.title         Only print notes of documents whose title contains this
+    * options.remove_key    Don't print key tags
+    * options.use_title     Print document title instead of path
+    * options.with_path     Print the file path with each line
+    * options.with_page     Print the page number with each line
+    * options.stdout        Output stream
+
+    """
+    for path, title, page, key, note in index.search(query, options.filter_keys, options.title):
+        if key != '' and not options.remove_key:
+            note = '<{0}>{1}</{0}>'.format(key, note)
+        print_note(note, (options.use_title and title or path, page), options)
+
+def main():
+    """Search highlighted areas in the annotation index.
+
+    usage: hillie-search [--help] [--version] [-h] [-b] [-n] [-s] [-t]
+                         [-k FILTER_KEYS] [--title TITLE] [--index INDEX]
+                         [--line-buffered]
+                         ...
+
+    Search highlighted areas in the annotation index (see hillie-index).
+    Prints all notes that contain every query term.
+
+    positional arguments:
+      query
+
+    optional arguments:
+      --help                show this help message and exit
+      --version             show program's version number and exit
+      -h, --no-filename     Suppress the prefixing of file names on output.
+      -b, --break           Insert a newline after each annotation
+      -n, --page-number     Prefix each line of output with the 1-based page
+                            number within its input file.
+      -s, --remove-key      Do not print xml-style keys.
+      -t, --use-title       Print document title instead of path.
+      -k FILTER_KEYS, --key FILTER_KEYS
+                            Show only listed keys. Use "None" for empty/no key
+      --title TITLE         Show only notes of documents whose title contains
+                            TITLE.
+      --index INDEX         Index file.
+      --line-buffered       Use line buffering on output. This can cause a
+                            performance penalty.
+
+    """
+    import argparse
+
+    usage = """Search highlighted areas in the annotation index (see hillie-index).
+    Prints all notes that contain every query term."""
+    parser = argparse.ArgumentParser(description=usage, add_help=False)
+
+    parser.add_argument('--help', action='help', help='show this help message and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s {}'.format(VERSION))
+    parser.add_argument('-h', '--no-filename', action='store_false', dest='with_path', default=True, help='Suppress the prefixing of file names on output.')
+    parser.add_argument('-b', '--break', action='store_true', dest='newline', default=False, help='Insert a newline after each annotation')
+    parser.add_argument('-n', '--page-number', action='store_true', dest='with_page', default=False, help='Prefix each line of output with the 1-based page number within its input file.')
+    parser.add_argument('-s', '--remove-key', action='store_true', dest='remove_key', default=False, help='Do not print xml-style keys.')
+    parser.add_argument('-t', '--use-title', action='store_true', dest='use_title', default=False, help='Print document title instead of path.')
+    parser.add_argument('-k', '--key', action='append', dest='filter_keys', default=[], help='Show only listed keys. Use "None" for empty/no key')
+    parser.add_argument('--title', dest='title', default=None, help='Show only notes of documents whose title contains TITLE.')
+    parser.add_argument('--index', dest='index', default=INDEX_FILE, help='Index file.')
+    parser.add_argument('--line-buffered', action='store_false', dest='buffered', default=True, help='Use line buffering on output. This can cause a performance penalty.')
+
+    parser.add_argument('query', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    # Allow comma-seperated keys and ensure lower case
+    args.filter_keys = reduce(list.__add__, [map(str.lower, map(str.strip, arg.split(','))) for arg in args.filter_keys], [])
+
+    if not os.path.exists(os.path.expanduser(args.index)):
+        sys.stderr.write('{}: {}: no index, run hillie-index first\n'.format(sys.argv[0], args.index))
+        sys.exit(1)
+
+    # Run search
+    interactive = sys.stdout.isatty() # Line buffering, as for the terminal
+    args.stdout = OutputSink(sys.stdout, args.buffered and not interactive and BUFFER_SIZE or 0)
+    args.stderr = sys.stderr
+    index = AnnotationIndex(args.index)
+    try:
+        search(index, ' '.join(args.query), args)
+        args.stdout.close()
+    except BrokenPipe: # Output was closed, e.g. by head
+        pass
+    index.close()
+
+## EOF ##
@@ -0,0 +1,159 @@
+"""Full-text index over annotations.
+
+The index is an SQLite database with an inverted list from stemmed
+terms to annotations. Each annotation is stored with its key, page and
+document (path and title). Documents are re-indexed only if their size
+or modification time changed since they were last indexed.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('AnnotationIndex', 'INDEX_FILE', 'terms', 'split_key')
+
+# imports
+from basics import RX_KEY, uniquepath
+from cache import CACHE_DIR
+from porter2 import cached_stem
+import os
+import os.path
+import re
+import sqlite3
+
+# config
+INDEX_FILE = os.path.join(CACHE_DIR, 'index.sqlite')
+RX_TERM = re.compile('\w+')
+
+
+## code ##
+
+def terms(text):
+    """Return the set of stemmed terms in *text*."""
+    return set(cached_stem(word) for word in RX_TERM.findall(text.lower()))
+
+class AnnotationIndex(object):
+    """Inverted index over annotations, stored at *path*.
+    """
+    def __init__(self, path=INDEX_FILE):
+        self.path = uniquepath(path)
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        self.conn = sqlite3.connect(self.path)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE,
+                size INTEGER,
+                mtime REAL,
+                title TEXT)
+            """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS notes (
+                id INTEGER PRIMARY KEY,
+                document INTEGER,
+                page TEXT,
+                key TEXT,
+                note TEXT)
+            """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT,
+                note INTEGER)
+            """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS notes_document ON notes (document)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS postings_term ON postings (term)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS postings_note ON postings (note)')
+        self.conn.commit()
+
+    def is_current(self, path):
+        """Return True if the document at *path* is indexed and unchanged."""
+        st = os.stat(path)
+        row = self.conn.execute(
+            'SELECT size, mtime FROM documents WHERE path = ?',
+            (uniquepath(path), )).fetchone()
+        return row is not None and tuple(row) == (st.st_size, st.st_mtime)
+
+    def add(self, path, title, notes):
+        """(Re-)index the document at *path*.
+        *notes* are (page, key, note) tuples.
+        """
+        key = uniquepath(path)
+        st = os.stat(key)
+        with self.conn: # Transaction
+            self._remove(key)
+            cur = self.conn.execute(
+                'INSERT INTO documents (path, size, mtime, title) VALUES (?, ?, ?, ?)',
+                (key, st.st_size, st.st_mtime, title))
+            doc_id = cur.lastrowid
+
+            for page, nkey, note in notes:
+                cur = self.conn.execute(
+                    'INSERT INTO notes (document, page, key, note) VALUES (?, ?, ?, ?)',
+                    (doc_id, page, nkey, note))
+                note_id = cur.lastrowid
+                self.conn.executemany(
+                    'INSERT INTO postings (term, note) VALUES (?, ?)',
+                    [(term, note_id) for term in terms(note)])
+
+    def prune(self):
+        """Remove documents that no longer exist. Returns their number."""
+        gone = [path for path, in self.conn.execute('SELECT path FROM documents') if not os.path.exists(path)]
+        with self.conn:
+            for path in gone:
+                self._remove(path)
+        return len(gone)
+
+    def _remove(self, path):
+        row = self.conn.execute('SELECT id FROM documents WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return
+        self.conn.execute('DELETE FROM postings WHERE note IN (SELECT id FROM notes WHERE document = ?)', row)
+        self.conn.execute('DELETE FROM notes WHERE document = ?', row)
+        self.conn.execute('DELETE FROM documents WHERE id = ?', row)
+
+    def search(self, query, keys=None, title=None):
+        """Yield (path, title, page, key, note) of all notes that contain
+        all terms in *query*. Results can be restricted to notes with one
+        of the *keys* ('none' for notes without key) and documents whose
+        title contains *title*.
+        """
+        sql = ['SELECT documents.path, documents.title, notes.page, notes.key, notes.note',
+               'FROM notes JOIN documents ON documents.id = notes.document',
+               'WHERE 1']
+        args = []
+
+        qterms = terms(query)
+        if len(qterms) > 0:
+            sql.append('AND notes.id IN ({})'.format(
+                ' INTERSECT '.join(['SELECT note FROM postings WHERE term = ?'] * len(qterms))))
+            args += list(qterms)
+
+        if keys is not None and len(keys) > 0:
+            keys = ['' if k == 'none' else k for k in keys]
+            sql.append('AND notes.key IN ({})'.format(', '.join('?' * len(keys))))
+            args += keys
+
+        if title is not None:
+            sql.append("AND documents.title LIKE ?")
+            args.append('%{}%'.format(title))
+
+        sql.append('ORDER BY documents.path, notes.id')
+        for row in self.conn.execute(' '.join(sql), args):
+            yield row
+
+    def close(self):
+        self.conn.close()
+
+def split_key(note):
+    """Return (key, note) of a *note* with an optional xml-style key."""
+    m = RX_KEY.match(note)
+    if m is None:
+        return '', note
+    return m.groups()[0].strip().lower(), m.groups()[1]
+
+## EOF ##
@@ -0,0 +1,82 @@
+"""Change detection across runs.
+
+A manifest records the signature (size, modification time, inode) of
+each document a program processed in its last run. Documents whose
+signature is unchanged can then be skipped without opening them.
+
+Annotations are not always stored in the document itself (e.g. Okular
+keeps them in a separate docdata file). The signature therefore covers
+all files a document's annotations are read from.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('Manifest', )
+
+# imports
+from basics import uniquepath
+from cache import CACHE_DIR
+import json
+import os
+import os.path
+import tempfile
+
+# config
+MANIFEST_FILE = 'manifest-{}.json'
+
+
+## code ##
+
+def _stat(path):
+    """Return [size, mtime, inode] of *path* or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+class Manifest(object):
+    """Manifest of the program *name*, stored in *cache_dir*.
+    """
+    def __init__(self, name, cache_dir=CACHE_DIR):
+        self.path = os.path.join(uniquepath(cache_dir), MANIFEST_FILE.format(name))
+        self.previous = {}
+        if os.path.exists(self.path):
+            with open(self.path) as ifile:
+                # Paths are byte strings, as elsewhere
+                self.previous = dict((path.encode('utf-8'), sig) for path, sig in json.load(ifile).iteritems())
+        self.current = dict(self.previous)
+
+    def check(self, path, *sources):
+        """Return the signature of the document at *path* if it changed
+        since the last run and None otherwise. *sources* are additional
+        files the document's annotations are read from.
+        """
+        signature = [_stat(p) for p in (path, ) + sources]
+        if self.previous.get(uniquepath(path)) == signature:
+            return None
+        return signature
+
+    def record(self, path, signature):
+        """Record that the document at *path* was processed in this run."""
+        self.current[uniquepath(path)] = signature
+
+    def save(self):
+        """Write the manifest of this run."""
+        if self.current == self.previous:
+            return
+
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # Write to a temporary file first, so an aborted run keeps the old manifest
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'w') as ofile:
+            json.dump(self.current, ofile)
+        os.rename(tmp, self.path)
+        self.previous = dict(self.current)
+
+## EOF ##
@@ -5,86 +5,212 @@ All rights reserved.
 
 """
 # EXPORTS
-__all__ = ('Dictionary', 'annotation_fixes', 'normalize_name', 'normalize_title')
+__all__ = ('Dictionary', 'shared_dictionary', 'annotation_fixes', 'normalize_name', 'normalize_title')
 
 # IMPORTS
-from porter2 import stem
+from basics import LRUCache
+from porter2 import stem, cached_stem
+from wordtable import WordTable
 import os.path
 import re
 import unicodedata
 import warnings
 
-def _levenshtein(s1, s2):
+## CONFIGURATION ##
+
+TABLE_SUFFIX = '.tbl'
+SEGMENT_MAX_LENGTH = 24 # Longest piece considered when splitting glued tokens; check() also accepts inflected forms
+
+# Cleanup of annotation text
+PUNCTUATION = '.,!?:;(){}[]'
+_PUNCTUATION_UNICODE = dict((ord(c), None) for c in PUNCTUATION)
+RX_BRACKETS = re.compile('\s*\[.*?\]\s*')
+RX_SPACING = re.compile('(?<=[.,!\]?:;)}])(?=\w)|(?<=\w)(?=[({\[])') # After closing, before opening punctuation
+RX_SPACES = re.compile('\s\s+')
+ABBREVIATIONS = {'e. g.': 'e.g.', 'a. k. a.': 'a.k.a.', 'i. e.': 'i.e.'}
+RX_ABBREVIATIONS = re.compile('|'.join(map(re.escape, ABBREVIATIONS)))
+
+## CODE ##
+
+def _levenshtein(s1, s2, limit=None):
+    """Return the edit distance between *s1* and *s2*.
+
+    If *limit* is given, only distances up to *limit* are computed
+    exactly; larger distances are reported as limit + 1. The dynamic
+    program is then restricted to a band of width 2 * limit + 1 around
+    the diagonal and stops as soon as the band exceeds the limit.
+    Memory is O(min(len(s1), len(s2))) in either case.
+
+    """
+    if len(s1) < len(s2): # Keep the rows short
+        s1, s2 = s2, s1
     l1 = len(s1)
     l2 = len(s2)
 
-    matrix = [range(l1 + 1)] * (l2 + 1)
-    for zz in range(l2 + 1):
-        matrix[zz] = range(zz,zz + l1 + 1)
-    for zz in range(0,l2):
-        for sz in range(0,l1):
-            if s1[sz] == s2[zz]:
-                matrix[zz+1][sz+1] = min(matrix[zz+1][sz] + 1, matrix[zz][sz+1] + 1, matrix[zz][sz])
-            else:
-                matrix[zz+1][sz+1] = min(matrix[zz+1][sz] + 1, matrix[zz][sz+1] + 1, matrix[zz][sz] + 1)
-
-    return matrix[l2][l1]
+    if limit is None or limit >= l1: # No band needed
+        row = range(l2 + 1)
+        for i, c1 in enumerate(s1):
+            cur = [i + 1]
+            for j, c2 in enumerate(s2):
+                cur.append(min(row[j] + (c1 != c2), row[j + 1] + 1, cur[j] + 1))
+            row = cur
+        return row[l2]
+
+    if l1 - l2 > limit: # Length difference alone exceeds limit
+        return limit + 1
+    if l2 == 0:
+        return l1
+
+    # row[j] is the distance between the current prefix of s1 and s2[:j]
+    beyond = limit + 1
+    row = range(l2 + 1)
+    for i in range(1, l1 + 1):
+        c1 = s1[i - 1]
+        lo = max(1, i - limit)
+        hi = min(l2, i + limit)
+        prev = row[lo - 1] # Diagonal predecessor
+        row[lo - 1] = lo == 1 and i or beyond
+        best = row[lo - 1]
+        for j in range(lo, hi + 1):
+            cost = prev + (c1 != s2[j - 1])
+            prev = row[j]
+            cost = min(cost, prev + 1, row[j - 1] + 1)
+            row[j] = cost
+            if cost < best:
+                best = cost
+        if hi < l2:
+            row[hi + 1] = beyond # Outside the band
+        if best > limit: # Early exit
+            return beyond
+
+    return min(row[l2], beyond)
+
+def _levenshtein_batch(s, candidates, limit=None):
+    """Return the edit distances between *s* and each of the *candidates*.
+    See _levenshtein for the meaning of *limit*.
+    """
+    return [_levenshtein(s, cand, limit) for cand in candidates]
 
 def _remove_punctuation(text):
-    return text \
-            .replace('.', '') \
-            .replace(',', '') \
-            .replace('!', '') \
-            .replace('?', '') \
-            .replace(':', '') \
-            .replace(';', '') \
-            .replace('(', '') \
-            .replace(')', '') \
-            .replace('{', '') \
-            .replace('}', '') \
-            .replace('[', '') \
-            .replace(']', '')
+    if isinstance(text, unicode):
+        return text.translate(_PUNCTUATION_UNICODE)
+    return text.translate(None, PUNCTUATION)
+
+def _replace_all(text, mods):
+    """Apply all (source, target) replacements in *mods* to *text* in a
+    single left-to-right rewrite. Where matches overlap, the earlier one
+    wins (the longer one, if they start at the same position).
+    """
+    hits = []
+    for src, trg in dict(mods).iteritems():
+        if src == '': continue
+        pos = text.find(src)
+        while pos >= 0:
+            hits.append((pos, -len(src), trg))
+            pos = text.find(src, pos + len(src))
+
+    if len(hits) == 0:
+        return text
+
+    hits.sort()
+    parts = []
+    last = 0
+    for pos, neglen, trg in hits:
+        if pos < last: # Overlaps with a previous replacement
+            continue
+        parts.append(text[last:pos])
+        parts.append(trg)
+        last = pos - neglen
+    parts.append(text[last:])
+    return ''.join(parts)
 
 class Dictionary(object):
+    """Stem and word lists for checking candidate words.
+
+    By default, the lists are read from precompiled word tables (see
+    wordtable.WordTable). The tables are rebuilt from 'collected-words'
+    if they are missing or stale. Lists with other suffixes are read as
+    plain text files (one word per line).
+
+    """
     def __init__(self, stems=None, words=None):
+        data = os.path.join(os.path.dirname(__file__), 'data')
+        src = os.path.join(data, 'collected-words')
         if stems is None:
-            stems = os.path.join(os.path.dirname(__file__), 'data', 'stems.t')
+            stems = os.path.join(data, 'stems' + TABLE_SUFFIX)
         if words is None:
-            words = os.path.join(os.path.dirname(__file__), 'data', 'words.t')
+            words = os.path.join(data, 'words' + TABLE_SUFFIX)
+
+        if self._is_stale(stems, src) or self._is_stale(words, src):
+            try:
+                self.build_dict(src, stems, words)
+            except (IOError, OSError) as err:
+                if not stems.endswith(TABLE_SUFFIX) or not words.endswith(TABLE_SUFFIX):
+                    raise
+                # Data directory not writeable; Fall back to the text lists
+                warnings.warn('Cannot build word tables: {}'.format(err))
+                stems = os.path.join(data, 'stems.t')
+                words = os.path.join(data, 'words.t')
+
+        self.stems = self._open(stems)
+        self.words = self._open(words)
+        self._segments = LRUCache(4096)
 
-        if not os.path.exists(stems) or not os.path.exists(words):
-            src = os.path.join(os.path.dirname(__file__), 'data', 'collected-words')
-            self.build_dict(src, stems, words)
+    @staticmethod
+    def _is_stale(path, src):
+        if not os.path.exists(path):
+            return True
+        if path.endswith(TABLE_SUFFIX):
+            try:
+                table = WordTable(path)
+            except IOError: # Broken table
+                return True
+            stale = table.is_stale(src)
+            table.close()
+            return stale
+        return False
 
-        self.stems = [l.strip() for l in open(stems)]
-        self.words = [l.strip() for l in open(words)]
+    @staticmethod
+    def _open(path):
+        if path.endswith(TABLE_SUFFIX):
+            return WordTable(path)
+        # Hashed lookup table; membership tests are O(1)
+        return frozenset(l.strip() for l in open(path))
 
     @staticmethod
     def build_dict(src, dst_stems='stems.t', dst_words='words.t'):
+        """Build the stem and word lists from the word list at *src*.
+        Targets with the table suffix are written as precompiled word
+        tables, all others as plain text files.
+
+        """
         from basics import unique
         words = [l.strip().lower() for l in open(src)]
         words = unique(words)
         words = sorted(words)
-
-        fw = open(dst_words, 'w')
-        for w in words:
-            fw.write(w + '\n')
-        fw.close()
+        Dictionary._write(words, dst_words, src)
 
         words = map(stem, words)
         words = unique(words)
         words = sorted(words)
+        Dictionary._write(words, dst_stems, src)
+
+    @staticmethod
+    def _write(words, dst, src):
+        if dst.endswith(TABLE_SUFFIX):
+            WordTable.build(words, dst, source=src)
+            return
 
-        fs = open(dst_stems, 'w')
+        fw = open(dst, 'w')
         for w in words:
-            fs.write(w + '\n')
-        fs.close()
+            fw.write(w + '\n')
+        fw.close()
 
     def check(self, candidate):
         if len(candidate) == 0:
             return False
 
-        normed = stem(candidate.lower())
+        normed = cached_stem(candidate.lower())
         return normed in self.stems
 
     def match(self, candidate):
@@ -94,14 +220,79 @@ class Dictionary(object):
         normed = candidate.lower()
         return normed in self.words
 
-def annotation_fixes(text, words, verbose=False):
+    def segment(self, token):
+        """Split *token* into the fewest dictionary words.
+
+        Ties are broken by the number of pieces that are words themselves
+        (rather than just sharing a stem with one). Pieces are at most
+        SEGMENT_MAX_LENGTH characters long. Returns the list of pieces, an
+        empty list if there are several best segmentations, or None if
+        there's none. The result is cached per token.
+
+        """
+        parts = self._segments.get(token, False)
+        if parts is False:
+            parts = self._segment(token)
+            self._segments[token] = parts
+        return parts
+
+    def _segment(self, token):
+        # best[i] holds (score, count, start) for the best segmentation of token[:i],
+        # where score is (pieces, pieces that don't match a word),
+        # count the number of segmentations with that score (up to 2), and start where
+        # the last piece begins. Lower scores are better.
+        n = len(token)
+        best = [None] * (n + 1)
+        best[0] = ((0, 0), 1, None)
+        for i in range(1, n + 1):
+            for j in range(max(0, i - SEGMENT_MAX_LENGTH), i):
+                if best[j] is None:
+                    continue
+
+                piece = token[j:i]
+                if not self.check(piece):
+                    continue
+
+                (pieces, misses), count, _ = best[j]
+                score = (pieces + 1, misses + (not self.match(piece)))
+                if best[i] is None or score < best[i][0]:
+                    best[i] = (score, count, j)
+                elif score == best[i][0]:
+                    best[i] = (score, min(2, best[i][1] + count), best[i][2])
+
+        if best[n] is None: # No segmentation
+            return None
+        if best[n][1] > 1: # No unique segmentation
+            return []
+
+        parts = []
+        while n > 0:
+            start = best[n][2]
+            parts.insert(0, token[start:n])
+            n = start
+        return parts
+
+_shared = None
+
+def shared_dictionary():
+    """Return the process-wide Dictionary. It is loaded on first use.
     """
+    global _shared
+    if _shared is None:
+        _shared = Dictionary()
+    return _shared
+
+def annotation_fixes(text, words=None, verbose=False):
+    """
+
+    If *words* is None, the shared dictionary is used. It is only loaded
+    once a word actually has to be checked.
 
     Systematic errors
     * Leading / trailing whitespaces
     * Punctuation
     * Misplaced hyphens:  hello-\nworld -> hello-world -> helloworld
-    * Missing whitespace: hello\nworld -> helloworld -> hello world
+    * Missing whitespace: hello\nworld -> helloworld -> hello world (also for several words)
 
     """
     # Unicode hyphens
@@ -111,7 +302,7 @@ def annotation_fixes(text, words, verbose=False):
     normed = text.strip()
 
     # Remove stuff in brackets
-    normed = re.sub('\s*\[.*?\]\s*', ' ', normed).strip()
+    normed = RX_BRACKETS.sub(' ', normed).strip()
 
     # Remove punctuation
     normed = _remove_punctuation(normed).strip()
@@ -124,6 +315,9 @@ def annotation_fixes(text, words, verbose=False):
         if w == '-' or len(w.strip()) == 0: # Invalid or empty words
             continue
 
+        if words is None: # Load dictionary only if needed
+            words = shared_dictionary()
+
         if '-' in w: # Misplaced hyphens
             repl = w.replace('-', '')
             if words.check(repl):
@@ -135,33 +329,24 @@ def annotation_fixes(text, words, verbose=False):
                 cands.extend(w.split('-'))
                 continue
 
-            splits = [[w[:i], w[i:]] for i in range(len(w)+1) if words.check(w[:i]) and words.check(w[i:])]
-            if len(splits) == 0:
+            parts = words.segment(w)
+            if parts is None:
                 if verbose:
                     warnings.warn('No solution found for {}'.format(w))
 
-            elif len(splits) == 1: # Unique result
-                mods.append((w, ' '.join(splits[0])))
+            elif len(parts) > 0: # Unique result
+                mods.append((w, ' '.join(parts)))
                 continue
 
-            else: # Several results
-                score = [sum(map(words.match, s)) for s in splits]
-                tmp = sorted(score, reverse=True)
-                if tmp[0] != tmp[1]: # Unique result
-                    idx = score.index(max(score))
-                    mods.append((w, ' '.join(splits[idx])))
-                    continue
-                elif verbose:
-                    warnings.warn('No unique solution found for {}'.format(w))
+            elif verbose: # Several results
+                warnings.warn('No unique solution found for {}'.format(w))
 
-    for src, trg in mods:
-        text = text.replace(src, trg)
+    text = _replace_all(text, mods)
 
     # global corrections
-    text = re.sub('([.,!\]?:;)}])(\w)', '\\1 \\2', text) # space after punctuation
-    text = text.replace('e. g.', 'e.g.').replace('a. k. a.', 'a.k.a.').replace('i. e.', 'i.e.') # common abbreviations
-    text = re.sub('(\w)([({\[])', '\\1 \\2', text) # space before punctuation
-    text = re.sub('\s\s+', ' ', text) # double space
+    text = RX_SPACING.sub(' ', text) # space after and before punctuation
+    text = RX_ABBREVIATIONS.sub(lambda m: ABBREVIATIONS[m.group(0)], text) # common abbreviations
+    text = RX_SPACES.sub(' ', text) # double space
 
     return text.strip()
 
@@ -201,7 +386,8 @@ def normalize_keyword(kw):
         # Chance of an abbreviation (min. 2 letters, in order)
         firsts = ''.join(map(lambda s: s[0].lower(), prefix.replace('-', ' ').split()))
         dmax = max(len(firsts), len(embraced))
-        if 1.0 * _levenshtein(firsts, embraced.lower()) / dmax <= 0.67:
+        limit = int(0.67 * dmax) # Largest distance still accepted
+        if 1.0 * _levenshtein(firsts, embraced.lower(), limit) / dmax <= 0.67:
             abbrevs.append((prefix.strip(), embraced.strip()))
             kw = kw.replace(suffix, '').strip()
 
@@ -216,6 +402,34 @@ def normalize_keyword(kw):
 if __name__ == '__main__':
     # Some tests
     import os.path
+    import sys
+    import timeit
+
+    if '--bench' in sys.argv:
+        # Dictionary lookups: hashed tables vs. plain lists
+        c = Dictionary()
+        probes = ['hello', 'world', 'therefore', 'conclude', 'xqzt', 'helloworld', 'annotation']
+        lists = (sorted(c.stems), sorted(c.words))
+        n = 1000
+        t_set = timeit.timeit(lambda: [stem(p) in c.stems and p in c.words for p in probes], number=n)
+        t_lst = timeit.timeit(lambda: [stem(p) in lists[0] and p in lists[1] for p in probes], number=n)
+        print 'lookups:   {} x {}'.format(n, len(probes))
+        print 'hashed:    {:.4f}s'.format(t_set)
+        print 'list:      {:.4f}s'.format(t_lst)
+        print 'speedup:   {:.1f}x'.format(t_lst / t_set)
+
+        # Startup: precompiled tables vs. text lists
+        data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        t_tbl = timeit.timeit(lambda: Dictionary(), number=10) / 10
+        t_txt = timeit.timeit(lambda: Dictionary(os.path.join(data, 'stems.t'), os.path.join(data, 'words.t')), number=10) / 10
+        print 'load tables: {:.4f}s'.format(t_tbl)
+        print 'load text:   {:.4f}s'.format(t_txt)
+
+        # Cleanup of real annotations (one per line)
+        if os.path.exists('/tmp/annots.t'):
+            annots = [l.strip() for l in open('/tmp/annots.t')]
+            t_fix = timeit.timeit(lambda: [annotation_fixes(a, c) for a in annots], number=1)
+            print 'annotation_fixes: {} notes in {:.4f}s'.format(len(annots), t_fix)
 
     if os.path.exists('/tmp/annots.t'):
         c = Dictionary()
@@ -9,8 +9,9 @@ __all__ = ('Okular', )
 
 # imports
 from basics import uniquepath
-from lxml import objectify
-from shared import Document, Annotation, filter_note, backup_file
+from lxml import etree, objectify
+from shared import Document, Annotation, note_filter, backup_file
+import errno
 import lxml
 import os.path
 import re
@@ -21,15 +22,24 @@ import sys
 
 class Okular(Document):
     """Extract and manipulate annotations in Okular files.
+
+    By default, the annotation file is read on demand, by a streaming
+    parser, and the document cannot be saved. If *writable* is set, the
+    file is parsed into a tree up front, which can be modified through
+    the annotation items and saved.
+
     """
 
     class Item(Annotation):
-        def __init__(self, client, note, key, page):
+        def __init__(self, client, note, key, page, type_=None, path=None, title=None):
             self.note = note
             self.key = key
             self.page = page
+            self.type = type_
+            self.path = path
+            self.title = title
             self._base = client
-            self._hl = client is not None and self._base.find('hl') or None
+            self._hl = client.getparent().find('hl') if client is not None else None # Sibling of base
         def set_content(self, note):
             if self._base is not None:
                 self._base.set('contents', note)
@@ -38,22 +48,39 @@ class Okular(Document):
                 self._hl.set('type', type_)
         def set_color(self, color):
             if self._base is not None:
-                self._base.set('color', type_)
+                self._base.set('color', color)
 
-    def __init__(self, path, options, pgm=''):
+    def __init__(self, path, options, pgm='', writable=False):
         self.pgm = pgm
 
         # make and store path
-        if not uniquepath(path).startswith(uniquepath(options.okular)):
-            prefix = os.stat(path).st_size
-            filename = os.path.basename(path)
-            path = os.path.join(options.okular, "{}.{}.{}".format(prefix, filename, 'xml'))
-        self.path = path
+        self.path = Okular.docdata(path, options)
 
         # open document
-        with open(uniquepath(self.path)) as ifile:
-            self.root = objectify.fromstring(ifile.read()) # FIXME: fix encoding errors
+        self.root = None
+        if writable:
+            with open(uniquepath(self.path)) as ifile:
+                self.root = objectify.fromstring(ifile.read()) # FIXME: fix encoding errors
+        elif not os.path.exists(uniquepath(self.path)):
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), self.path)
+
+    @staticmethod
+    def docdata(path, options):
+        """Return the path of Okular's annotation file for the document at *path*.
+        The file is looked up in *options.docdata_index* (if any) first.
+        """
+        if uniquepath(path).startswith(uniquepath(options.okular)):
+            return path
 
+        index = getattr(options, 'docdata_index', None)
+        if index is not None:
+            found = index.lookup(path)
+            if found is not None:
+                return found
+
+        prefix = os.stat(path).st_size
+        filename = os.path.basename(path)
+        return os.path.join(options.okular, "{}.{}.{}".format(prefix, filename, 'xml'))
 
     def annotations(self, options):
         """Read annotations from okular's temporary annotation storage.
@@ -63,63 +90,95 @@ class Okular(Document):
 
         """
         try:
-            title = self.path
-            if options.use_title:
-                m = re.search('^\d+\.(.*)\.xml$', self.path, re.I)
-                if m is not None:
-                    title = m.groups()[0]
-                    title, ext = os.path.splitext(title)
-
-            for page in self.root.pageList.page:
-                if not hasattr(page, 'annotationList') or \
-                   not hasattr(page.annotationList, 'annotation'):
-                    continue # Page has no annotation
-
-                for annot in page.annotationList.annotation:
-                    if annot.get('type', '-1') in options.valid_types:
-                        base = annot.find('base')
-                        if base is None: continue # Annotation has no content
-
-                        note = base.get('contents', '').strip()
-                        if note == '': continue # Annotation has no content
-
-                        note, key = filter_note(note, options)
-                        if note is not None:
-                            page_no = page.get('number', -1)
-                            yield Okular.Item(base, note, key, (title, page_no))
+            title = os.path.basename(self.path)
+            m = re.search('^\d+\.(.*)\.xml$', title, re.I)
+            if m is not None:
+                title = m.groups()[0]
+            title, ext = os.path.splitext(title)
+            display = options.use_title and title or self.path
+
+            flt = note_filter(options)
+            writable = self.root is not None
+            for page, annot in writable and self._walk() or self._stream():
+                annot_type = annot.get('type', '-1')
+                if annot_type in flt.types:
+                    base = annot.find('base')
+                    if base is None: continue # Annotation has no content
+
+                    note = base.get('contents', '').strip()
+                    if note == '': continue # Annotation has no content
+
+                    note, key = flt(note)
+                    if note is not None:
+                        page_no = page.get('number', -1)
+                        yield Okular.Item(base if writable else None, note, key, (display, page_no), annot_type, self.path, title)
 
         except IOError, err: # Abort on failure
+            self.failed = True
             msg = '{}: {}: {}\n'.format(self.pgm, self.path, err.message)
             options.stderr.write(msg)
             if not options.buffered:
                 options.stderr.flush()
 
         except lxml.etree.XMLSyntaxError, err: # Abort on failure
+            self.failed = True
             msg = '{}: {}: {}\n'.format(self.pgm, self.path, err.message)
             options.stderr.write(msg)
             if not options.buffered:
                 options.stderr.flush()
 
         except UnicodeEncodeError, err: # Abort on failure
+            self.failed = True
             msg = '{}: {}: {}\n'.format(self.pgm, self.path, err.message)
             options.stderr.write(msg)
             if not options.buffered:
                 options.stderr.flush()
 
         except AttributeError, err: # Document has no annotations
+            self.failed = True
             msg = '{}: {}: {}\n'.format(self.pgm, self.path, err.message)
             options.stderr.write(msg)
             if not options.buffered:
                 options.stderr.flush()
 
+    def _walk(self):
+        """Yield (page, annotation) elements from the tree."""
+        for page in self.root.pageList.page:
+            if not hasattr(page, 'annotationList') or \
+               not hasattr(page.annotationList, 'annotation'):
+                continue # Page has no annotation
+
+            for annot in page.annotationList.annotation:
+                yield page, annot
+
+    def _stream(self):
+        """Yield (page, annotation) elements while parsing the file.
+        Elements are cleared once processed, so the tree never grows
+        beyond the current page.
+        """
+        for event, elem in etree.iterparse(uniquepath(self.path), events=('end', )):
+            if elem.tag == 'annotation':
+                parent = elem.getparent()
+                page = parent.getparent() if parent is not None else None
+                if page is not None and parent.tag == 'annotationList' and page.tag == 'page':
+                    yield page, elem
+
+            elif elem.tag in ('page', 'generalInfo'): # Processed subtree
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
     def save(self, target, options):
         """
         """
+        if self.root is None:
+            raise IOError('{}: document was not opened for writing'.format(self.path))
+
         # backup original
         backup_file(self.path, op=os.rename) # FIXME: Consider options
 
         # overwrite original
         with open(target, 'w') as ofile:
-            etree.ElementTree(document).write(ofile, pretty_print=True)
+            etree.ElementTree(self.root).write(ofile, pretty_print=True)
 
 ## EOF ##
@@ -5,11 +5,11 @@ All rights reserved.
 
 """
 # exports
-__all__ = ('Pdf', )
+__all__ = ('Pdf', 'CachedPdf', 'open_pdf')
 
 # imports
 from basics import uniquepath
-from shared import Document, Annotation, filter_note
+from shared import Document, Annotation, note_filter
 import glib
 import os.path
 import poppler
@@ -24,10 +24,13 @@ class Pdf(Document):
     """
 
     class Item(Annotation):
-        def __init__(self, client, note, key, page):
+        def __init__(self, client, note, key, page, type_=None, path=None, title=None):
             self.note = note
             self.key = key
             self.page = page
+            self.type = type_
+            self.path = path
+            self.title = title
             self._annot = client
         def set_content(self, note):
             if self._annot is not None:
@@ -47,41 +50,54 @@ class Pdf(Document):
         """Read annotations from a PDF file.
         """
         try:
-            title = self.path
-            if options.use_title:
-                embed = self.document.get_property('title')
-                if title is not None and title != '': # Pick embedded title
-                    title = embed
-                else: # Pick filename w/o extension instead
-                    title = os.path.basename(self.path)
-                    title, ext = os.path.splitext(title)
-
-            for i in range(self.document.get_n_pages()):
-                page = self.document.get_page(i)
-                annot_mappings = page.get_annot_mapping()
-                num_annots = len(annot_mappings)
-                if num_annots > 0:
-                    for annot_mapping in annot_mappings:
-                        annot = annot_mapping.annot
-                        annot_type = annot.get_annot_type().value_nick
-                        annot_type = annot_type[0].upper() + annot_type[1:]
-                        if annot_type.lower() in options.valid_types:
-
-                            note = annot.get_contents()
-                            if note is None: continue
-                            note = note.strip()
-
-                            note, key = filter_note(note, options)
-                            if note is not None:
-                                page_no = str(page.get_index() + 1)
-                                yield Pdf.Item(annot, note, key, (title, page_no))
+            title = self._embedded_title()
+            if title is None or title == '': # Pick filename w/o extension instead
+                title = os.path.basename(self.path)
+                title, ext = os.path.splitext(title)
+            display = options.use_title and title or self.path
+
+            flt = note_filter(options)
+            for annot, annot_type, page_no, note in self._walk():
+                if annot_type in flt.types: # Type nicks are lower case
+
+                    note = note() # Fetch contents only if needed
+                    if note is None: continue
+                    note = note.strip()
+
+                    note, key = flt(note)
+                    if note is not None:
+                        yield Pdf.Item(annot, note, key, (display, page_no), annot_type, self.path, title)
 
         except glib.GError as err:
+            self.failed = True
             msg = '{}: {}: {}\n'.format(self.pgm, self.path, err.message)
             options.stderr.write(msg)
             if not options.buffered:
                 options.stderr.flush()
 
+    def records(self):
+        """Return the embedded title and all annotations of the document
+        as (type, page number, contents) tuples, without any filtering.
+        May raise glib.GError.
+        """
+        records = [(annot_type, page_no, note()) for annot, annot_type, page_no, note in self._walk()]
+        return self._embedded_title(), [rec for rec in records if rec[2] is not None]
+
+    def _embedded_title(self):
+        return self.document.get_property('title')
+
+    def _walk(self):
+        """Yield (annotation, type, page number, contents getter) for all annotations."""
+        for i in range(self.document.get_n_pages()):
+            page = self.document.get_page(i)
+            annot_mappings = page.get_annot_mapping()
+            num_annots = len(annot_mappings)
+            if num_annots > 0:
+                page_no = str(page.get_index() + 1)
+                for annot_mapping in annot_mappings:
+                    annot = annot_mapping.annot
+                    yield annot, annot.get_annot_type().value_nick, page_no, annot.get_contents
+
     def save(self, target, options):
         """Save document to *target* file.
         """
@@ -114,4 +130,48 @@ class Pdf(Document):
             if ans == 'y':
                 os.unlink(tfile)
 
+class CachedPdf(Pdf):
+    """Annotations of a PDF file, served from previously extracted records.
+    The PDF file itself is not opened. The document cannot be modified.
+    """
+    def __init__(self, path, title, records, pgm=''):
+        self.pgm = pgm
+        self.path = path
+        self.title = title
+        self._records = records
+
+    def records(self):
+        return self.title, self._records
+
+    def _embedded_title(self):
+        return self.title
+
+    def _walk(self):
+        for annot_type, page_no, note in self._records:
+            yield None, annot_type, page_no, lambda note=note: note
+
+    def save(self, target, options):
+        raise IOError('{}: cached document cannot be saved'.format(self.path))
+
+def open_pdf(path, options, pgm=''):
+    """Open the PDF file at *path*, going through the annotation cache in
+    *options.cache* (if not None). Cached documents are read-only.
+    """
+    cache = options.cache
+    if cache is None:
+        return Pdf(path, options, pgm=pgm)
+
+    entry = cache.lookup(path)
+    if entry is not None: # Cache hit
+        return CachedPdf(path, entry[0], entry[1], pgm=pgm)
+
+    document = Pdf(path, options, pgm=pgm)
+    try:
+        title, records = document.records()
+    except glib.GError: # Not cached; annotations() reports the error
+        return document
+
+    cache.store(path, title, records)
+    return CachedPdf(path, title, records, pgm=pgm)
+
 ## EOF ##
@@ -5,9 +5,12 @@ Adapted from pyporter2 by Michael Dirolf.
 
 This algorithm is more correct but (at least in this implementation)
 several times slower than the original porter algorithm as implemented
-in stemming.porter.
+in stemming.porter. The suffix rules of steps 2 to 4 are compiled into
+longest-match dispatch tables, so each step looks up its rule with a
+few dictionary probes on the word's tail instead of testing every rule.
 """
 
+from basics import LRUCache
 import re
  
 r_exp = re.compile(r"[^aeiouy]*[aeiouy]+[^aeiouy](\w*)")
@@ -128,6 +131,22 @@ def step_1c(word):
                 return word[:-1] + 'i'
     return word
 
+def _dispatch_table(rules):
+    """Compile suffix *rules* (tuples starting with the suffix) into a
+    lookup table and the distinct suffix lengths, longest first.
+    """
+    table = dict((rule[0], rule) for rule in rules)
+    lengths = sorted(set(len(end) for end in table), reverse=True)
+    return table, lengths
+
+def _longest_match(word, (table, lengths)):
+    """Return the rule with the longest suffix of *word*, or None."""
+    for length in lengths:
+        rule = table.get(word[-length:])
+        if rule is not None:
+            return rule
+    return None
+
 def step_2_helper(word, r1, end, repl, prev):
         if word.endswith(end):
             if len(word) - len(end) >= r1:
@@ -163,12 +182,13 @@ s2_triples = (('ization', 'ize', []),
                ('ogi', 'og', ['l']),
                ('li', '', ['c', 'd', 'e', 'g', 'h', 'k', 'm', 'n', 'r', 't']))
 
+s2_table = _dispatch_table(s2_triples)
+
 def step_2(word, r1):
-    for trip in s2_triples:
-        attempt = step_2_helper(word, r1, trip[0], trip[1], trip[2])
-        if attempt:
-            return attempt
-    return word
+    trip = _longest_match(word, s2_table)
+    if trip is None:
+        return word
+    return step_2_helper(word, r1, trip[0], trip[1], trip[2]) or word
 
 def step_3_helper(word, r1, r2, end, repl, r2_necessary):
     if word.endswith(end):
@@ -189,27 +209,25 @@ s3_triples = (('ational', 'ate', False),
                ('ical', 'ic', False),
                ('ness', '', False),
                ('ful', '', False))
+s3_table = _dispatch_table(s3_triples)
+
 def step_3(word, r1, r2):
-    for trip in s3_triples:
-        attempt = step_3_helper(word, r1, r2, trip[0], trip[1], trip[2])
-        if attempt:
-            return attempt
-    return word
+    trip = _longest_match(word, s3_table)
+    if trip is None:
+        return word
+    return step_3_helper(word, r1, r2, trip[0], trip[1], trip[2]) or word
 
 s4_delete_list = ('al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement',
                   'ment', 'ent', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize')
 
+# (suffix, number of characters to delete); 'ion' is only deleted after 's' or 't'
+s4_table = _dispatch_table([(end, len(end)) for end in s4_delete_list] + [('sion', 3), ('tion', 3)])
+
 def step_4(word, r2):
-    for end in s4_delete_list:
-        if word.endswith(end):
-            if len(word) - len(end) >= r2:
-                return word[:-len(end)]
-            return word
- 
-    if word.endswith('sion') or word.endswith('tion'):
-        if len(word) - 3 >= r2:
-            return word[:-3]
- 
+    rule = _longest_match(word, s4_table)
+    if rule is not None:
+        if len(word) - rule[1] >= r2:
+            return word[:-rule[1]]
     return word
  
 def step_5(word, r1, r2):
@@ -281,4 +299,57 @@ def stem(word):
 
     return word
 
- 
+
+class CachedStemmer(object):
+    """Memoizing front-end to stem().
+
+    Stems are kept in a bounded LRU cache of *maxsize* entries. The
+    cache's hit and miss counters help to choose a suitable size.
+    """
+    def __init__(self, maxsize=65536):
+        self.cache = LRUCache(maxsize)
+
+    def __call__(self, word):
+        normed = self.cache.get(word)
+        if normed is None:
+            normed = stem(word)
+            self.cache[word] = normed
+        return normed
+
+    def stem_all(self, words):
+        """Return the stems of all *words* as list."""
+        return [self(word) for word in words]
+
+    def resize(self, maxsize):
+        self.cache.resize(maxsize)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+cached_stem = CachedStemmer()
+
+def stem_all(words):
+    """Stem all *words* through the shared cache."""
+    return cached_stem.stem_all(words)
+
+
+if __name__ == '__main__':
+    # Benchmark and consistency check on the collected word list
+    import os.path
+    import time
+
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    words = [l.strip().lower() for l in open(os.path.join(data, 'collected-words'))]
+
+    start = time.time()
+    stems = map(stem, words)
+    duration = time.time() - start
+    print 'stemmed {} words in {:.2f}s ({:.0f} words/s)'.format(len(words), duration, len(words) / duration)
+
+    reference = set(l.strip() for l in open(os.path.join(data, 'stems.t')))
+    print 'consistent with stems.t:', set(stems) == reference
@@ -7,25 +7,36 @@ All rights reserved.
 
 """
 # exports
-__all__ = ('pusher', 'main')
+__all__ = ('pusher', 'is_pdf', 'load_attachments', 'write_tags', 'restore_tags', 'backup_path', 'prune_backups', 'main')
 
 # imports
 from basics import uniquepath, VERSION
+from docdata import DocdataIndex
+from manifest import Manifest
 from okular import Okular
-from os.path import basename, dirname, isdir
+from os.path import basename, dirname
 from os.path import exists as pexists
 from os.path import join as pjoin
+from shared import walk_files
+from sink import NullSink
 from shutil import copy
-import cStringIO
 import datetime
-import magic
+import fnmatch
+import json
 import os
 import sqlite3
+import sys
 
 # config
 ANSWER_DEFAULT = 'y' # y, n, q, s
 VALID_TYPES = ['1', '4']
 SUPPORTED_MIME_TYPES = ('application/pdf', )
+PDF_MAGIC = '%PDF-'
+SNIFF_SIZE = 1024 # PDF readers accept the header anywhere in the first kilobyte
+BACKUP_KEEP = 10
+BACKUP_PATTERN = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]--[0-9][0-9][0-9][0-9]' # date and counter
+CHANGESET_SUFFIX = '.json'
+IGNORE_PATTERNS = ('.zotero-*', '*.html', '*.htm', '*.css', '*.js', '*.png', '*.jpg', '*.gif') # Zotero caches and snapshots
 
 
 ## code ##
@@ -34,58 +45,228 @@ def pusher(conn, files, options):
     """Retrieves highlighted notes from documents (Okular temporary files)
     and stores it in the Zotero database as tag.
 
+    The tags of all documents are collected first and then written in a
+    single transaction. Nothing is written if the user aborts.
+
     Options:
     * options.recursive     Handle directories
+    * options.ignore        Skip directory entries matching these patterns
     * options.valid_types   PDF annotation types to process
     * options.filter_keys   Only print stated keys.
     * options.ask           Ask before adding tag.
+    * options.manifest      Only process documents changed since the last run (or None)
+    * options.changeset     Path to write the changes to, for restore_tags (or None)
+    * options.docdata_index Index of Okular's annotation files (or None)
+
+    """
+    tags = []
+    attachments = load_attachments(conn)
+    if not _collect_tags(attachments, files, options, tags):
+        return False # Abort
+
+    write_tags(conn, tags, options.changeset)
+    return True
+
+def write_tags(conn, tags, changeset=None):
+    """Add tags to Zotero items. *tags* are (itemID, name) pairs.
+
+    If *changeset* is given, the tags and itemTags rows that are actually
+    inserted are written to that file (as JSON) before the changes are
+    committed. The changes can be undone with restore_tags.
+
+    """
+    # Names are compared to the database's (unicode) names
+    tags = set((itemID, isinstance(name, str) and name.decode('utf-8') or name) for itemID, name in tags)
+    if len(tags) == 0:
+        return
+
+    # Bulk write settings; The journal mode is persistent, so restore it afterwards
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Create missing tags, then resolve all names at once
+            tag_ids = dict(conn.execute('SELECT name, tagID FROM tags'))
+            missing = set(name for itemID, name in tags if name not in tag_ids)
+            if len(missing) > 0:
+                conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(name, ) for name in missing])
+                tag_ids = dict(conn.execute('SELECT name, tagID FROM tags'))
+
+            rows = set((itemID, tag_ids[name]) for itemID, name in tags)
+            if changeset is not None:
+                rows -= set(conn.execute('SELECT itemID, tagID FROM itemTags'))
+                _write_changeset(changeset, [(tag_ids[name], name) for name in missing], rows)
+
+            conn.executemany(
+                'INSERT OR IGNORE INTO itemTags (itemID, tagID, type) VALUES (?, ?, 0)',
+                rows)
+
+            # TODO: cleanup (remove unliked tags)
+
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    finally:
+        conn.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+
+def _write_changeset(path, tags, item_tags):
+    """Write inserted *tags* (tagID, name) and *item_tags* (itemID, tagID) to *path*."""
+    changeset = {
+        'created': datetime.datetime.now().isoformat(),
+        'tags': sorted(tags),
+        'itemTags': sorted(item_tags),
+        }
+    with open(path, 'w') as ofile:
+        json.dump(changeset, ofile)
+
+def restore_tags(conn, changeset):
+    """Undo the changes recorded in the *changeset* file by write_tags.
+    Tags are only removed if no other item uses them (anymore).
+    Returns the number of removed tags and itemTags rows. Raises IOError
+    if the file cannot be read and ValueError if it's not a changeset.
+    """
+    with open(changeset) as ifile:
+        changes = json.load(ifile)
+
+    # Both lists hold (ID, ID or name) pairs
+    if not isinstance(changes, dict) or not all(
+            isinstance(changes.get(key), list) and
+            all(isinstance(row, list) and len(row) == 2 for row in changes[key])
+            for key in ('tags', 'itemTags')):
+        raise ValueError('Not a changeset')
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        item_tags = conn.executemany(
+            'DELETE FROM itemTags WHERE itemID = ? AND tagID = ?',
+            changes['itemTags']).rowcount
+        tags = conn.executemany("""
+            DELETE FROM tags WHERE tagID = ? AND name = ?
+            AND NOT EXISTS (SELECT 1 FROM itemTags WHERE itemTags.tagID = tags.tagID)
+            """,
+            changes['tags']).rowcount
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+    return tags, item_tags
+
+def backup_path(path, suffix=''):
+    """Return a new, dated backup path for the file at *path*."""
+    rid = 0
+    while True: # Find non-existing backup path
+        bpath = "{}-{}--{:04d}{}".format(path, datetime.datetime.now().date().isoformat(), rid, suffix)
+        if not pexists(bpath): return bpath
+        rid += 1
+
+def prune_backups(path, keep, suffix=''):
+    """Remove all but the *keep* most recent backups of *path* created
+    by backup_path with *suffix*. Returns the removed paths.
+    """
+    prefix = basename(path) + '-'
+    backups = []
+    for name in os.listdir(dirname(path)):
+        if name.startswith(prefix) and name.endswith(suffix) and \
+           fnmatch.fnmatch(name[len(prefix):len(name) - len(suffix)], BACKUP_PATTERN):
+            backups.append(pjoin(dirname(path), name))
+
+    backups.sort() # Oldest first
+    pruned = backups[:max(0, len(backups) - keep)]
+    for bpath in pruned:
+        os.unlink(bpath)
+    return pruned
+
+def load_attachments(conn):
+    """Return a map from attachment paths to (parentItemID, key) pairs of
+    the attachments with that path. Paths are either absolute (linked
+    files) or 'storage:<filename>' (files in the Zotero storage, in a
+    directory named after the attachment's key).
+    """
+    attachments = {}
+    for path, parentID, key in conn.execute("""
+            SELECT itemAttachments.path, itemAttachments.parentItemID, items.key
+            FROM itemAttachments
+            JOIN items ON items.itemID = itemAttachments.itemID
+            WHERE itemAttachments.path IS NOT NULL
+            AND itemAttachments.parentItemID IS NOT NULL
+            """):
+        attachments.setdefault(path, []).append((parentID, key))
+    return attachments
+
+def _find_item(attachments, path, options):
+    """Return the itemID of the Zotero item *path* is attached to and
+    the IDs of all candidates.
+    """
+    if uniquepath(path).startswith(options.storage): # inside storage
+        candidates = attachments.get("storage:{}".format(basename(path)), [])
+        if len(candidates) > 1: # Filename is not unique, pick by storage directory
+            khandle = basename(dirname(path))
+            candidates = [(parentID, key) for parentID, key in candidates if key == khandle] or candidates
+
+    else: # outside storage
+        candidates = attachments.get(uniquepath(path), [])
+
+    itemIDs = sorted(set(parentID for parentID, key in candidates))
+    return len(itemIDs) == 1 and itemIDs[0] or None, itemIDs
+
+def is_pdf(path):
+    """Return True if the file at *path* is a PDF document.
+
+    The PDF header is sniffed from the file's first kilobyte. libmagic is
+    only consulted for files with a .pdf extension but without a header.
 
     """
-    for path in files:
-        if isdir(path):
-            if options.recursive:
-                if not pusher(conn, [pjoin(path, p) for p in os.listdir(path)], options):
-                    return False # Abort
-            continue # Omit directories
-
-        if magic.from_file(path, mime=True) not in SUPPORTED_MIME_TYPES:
+    try:
+        with open(path, 'rb') as ifile:
+            head = ifile.read(SNIFF_SIZE)
+    except IOError:
+        return False
+
+    if head.startswith(PDF_MAGIC):
+        return True
+    if os.path.splitext(path)[1].lower() != '.pdf':
+        return False
+    if PDF_MAGIC in head: # Leading garbage
+        return True
+
+    import magic # Ambiguous, ask libmagic
+    return magic.from_file(path, mime=True) in SUPPORTED_MIME_TYPES
+
+def _collect_tags(attachments, files, options, tags):
+    """Append (itemID, name) pairs of the tags in *files* to *tags*.
+    Returns False if the user aborted.
+    """
+    for path in walk_files(files, options.recursive, options.ignore):
+        signature = None
+        if options.manifest is not None:
+            signature = options.manifest.check(path, Okular.docdata(path, options))
+            if signature is None: # Unchanged since the last run
+                continue
+
+        if not is_pdf(path):
             # Ignore unknown file types
+            if signature is not None: options.manifest.record(path, signature)
             continue
 
         print "\n== {} ==".format(basename(path))
 
-        if uniquepath(path).startswith(uniquepath(options.storage)): # inside storage
-            phandle = "storage:{}".format(basename(path))
-            khandle = basename(dirname(path))
-            itemID = conn.execute("""
-                SELECT items.itemID
-                FROM items
-                JOIN itemAttachments ON itemAttachments.parentItemID = items.itemID
-                WHERE itemAttachments.path = ?
-                --AND   items.key = ?
-                """,
-                (phandle, ) #khandle)
-                ).fetchone() # FIXME: What if filename is not unique?
-
-        else: # outside storage
-            itemID = conn.execute("""
-                SELECT items.itemID
-                FROM items
-                JOIN itemAttachments ON itemAttachments.parentItemID = items.itemID
-                WHERE itemAttachments.path = ?
-                """,
-                (uniquepath(path), )
-                ).fetchone()
-
+        itemID, candidates = _find_item(attachments, path, options)
+        if len(candidates) > 1:
+            print "Attached to several items in Zotero ({})".format(', '.join(map(str, candidates)))
+            continue
         if itemID is None:
             print "Item not found in Zotero"
             continue
 
-        itemID = itemID[0]
         try:
             document = Okular(path, options)
         except IOError:
             print "No annotations"
+            if signature is not None: options.manifest.record(path, signature)
             continue
 
         for item in document.annotations(options):
@@ -103,28 +284,21 @@ def pusher(conn, files, options):
             elif ans == 'q': return False # Abort
             elif ans == 'y': # Process
                 if not options.ask: print "Adding '{}'".format(note)
+                tags.append((itemID, note))
 
-                conn.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (note, ))
-                conn.execute("""
-                    INSERT OR IGNORE
-                    INTO itemTags(itemID, tagID, type)
-                    SELECT itemAttachments.parentItemID, tags.tagID, 0
-                    FROM tags, itemAttachments
-                    WHERE tags.name = ?
-                    AND itemAttachments.parentItemID = ?
-                    """,
-                    (note, itemID)
-                )
+        else: # All annotations processed
+            if document.failed: # Retry next time
+                print "Cannot read annotations"
+            elif signature is not None: options.manifest.record(path, signature)
 
-                # TODO: cleanup (remove unliked tags)
-
-    conn.commit()
     return True
 
 def main():
     """Store highlighted areas from Okular annotations in Zotero as tags.
 
     usage: pusher [--help] [--version] [-k FILTER_KEYS] [-r] [-a] [--backup]
+                  [--full-backup] [--keep KEEP] [--restore CHANGESET]
+                  [--changed-only] [--ignore PATTERN]
                   [--annotation-type VALID_TYPES] [--okular OKULAR]
                   [--storage STORAGE] [--zotero ZOTERO]
                   ...
@@ -142,7 +316,19 @@ def main():
                             Show only listed keys. Use "None" for empty/no key
       -r, --recursive       Read all files under each directory, recursively.
       -a, --ask             Ask when adding tags
-      --backup              Backup database before editing
+      --backup              Save the changes to the database, so they can be
+                            undone with --restore. This is the default when no
+                            files are given.
+      --full-backup         Copy the database before editing
+      --keep KEEP           Number of backups to keep (of each kind, at least
+                            one).
+      --restore CHANGESET   Undo the changes saved by --backup in CHANGESET.
+      --changed-only, --since-last-run
+                            Only process documents whose file or Okular
+                            annotations changed since the last run with
+                            --changed-only.
+      --ignore PATTERN      Skip files and directories matching PATTERN, in
+                            addition to Zotero caches and snapshots.
       --annotation-type VALID_TYPES
                             Extracted annotation types
       --okular OKULAR       Okular annotation root
@@ -160,7 +346,12 @@ def main():
     parser.add_argument('-k', '--key', action='append', dest='filter_keys', default=[], help='Show only listed keys. Use "None" for empty/no key')
     parser.add_argument('-r', '--recursive', action='store_true', dest='recursive', default=False, help='Read all files under each directory, recursively.')
     parser.add_argument('-a', '--ask', action='store_true', dest='ask', default=False, help='Ask when adding tags')
-    parser.add_argument('--backup', action='store_true', dest='backup', default=False, help='Backup database before editing')
+    parser.add_argument('--backup', action='store_true', dest='backup', default=False, help='Save the changes to the database, so they can be undone with --restore. This is the default when no files are given.')
+    parser.add_argument('--full-backup', action='store_true', dest='full_backup', default=False, help='Copy the database before editing')
+    parser.add_argument('--keep', type=int, dest='keep', default=BACKUP_KEEP, help='Number of backups to keep (of each kind, at least one).')
+    parser.add_argument('--restore', dest='restore', default=None, metavar='CHANGESET', help='Undo the changes saved by --backup in CHANGESET.')
+    parser.add_argument('--changed-only', '--since-last-run', action='store_true', dest='changed_only', default=False, help='Only process documents whose file or Okular annotations changed since the last run with --changed-only.')
+    parser.add_argument('--ignore', action='append', dest='ignore', default=[], help='Skip files and directories matching PATTERN, in addition to Zotero caches and snapshots.', metavar='PATTERN')
     parser.add_argument('--annotation-type', action='append', dest='valid_types', default=[], help='Extracted annotation types')
     parser.add_argument('--okular', default="~/.kde/share/apps/okular/docdata", help="Okular annotation root")
     parser.add_argument('--storage', default="~/.zotero/data/storage", help="Zotero pdf storage")
@@ -168,10 +359,14 @@ def main():
     parser.add_argument('paths', nargs=argparse.REMAINDER, help="Files to get tags from. If none given, all files in the zotero storage are processed.")
 
     args = parser.parse_args()
+    if args.keep < 1: # Would remove the backup of this run
+        parser.error('argument --keep: must be at least 1')
 
     if len(args.valid_types) == 0: # Default annotation types if none given.
         args.valid_types = VALID_TYPES
 
+    args.ignore = list(IGNORE_PATTERNS) + args.ignore
+
     # Allow comma-seperated keys/types and ensure lower case
     args.filter_keys = reduce(list.__add__, [map(str.lower, map(str.strip, arg.split(','))) for arg in args.filter_keys], [])
 
@@ -180,6 +375,18 @@ def main():
     args.zotero  = uniquepath(args.zotero)
     args.storage = uniquepath(args.storage)
     assert pexists(args.zotero),  "Zotero database not found"
+
+    if args.restore is not None: # Undo a previous run
+        conn = sqlite3.connect(args.zotero)
+        try:
+            tags, item_tags = restore_tags(conn, uniquepath(args.restore))
+        except (IOError, ValueError) as err:
+            msg = getattr(err, 'strerror', None) or getattr(err, 'message', err)
+            sys.stderr.write('{}: {}: {}\n'.format(sys.argv[0], args.restore, msg))
+            sys.exit(1)
+        print "Removed {} tags from items and {} unused tags".format(item_tags, tags)
+        return
+
     assert pexists(args.okular),  "Okular root directory not found"
     assert pexists(args.storage), "Zotero pdf storage not found"
 
@@ -197,24 +404,34 @@ def main():
     args.with_page  = False     # No prefix
     args.use_title  = False     # No prefix
     args.newline    = False     # No newlines
-    args.stdout    = cStringIO.StringIO()
-    args.stderr    = cStringIO.StringIO()
+    args.stdout    = NullSink()  # Output is not shown
+    args.stderr    = NullSink()
 
     # create backup
-    if args.backup:
-        rid = 0
-        while True: # Find non-existing backup path
-            bpath = "{}-{}--{:04d}".format(args.zotero, datetime.datetime.now().date().isoformat(), rid)
-            if not pexists(bpath): break
-            rid += 1
-
-        copy(args.zotero, bpath) # backup
+    args.changeset = None
+    if args.backup: # Changes only, written by pusher
+        args.changeset = backup_path(args.zotero, CHANGESET_SUFFIX)
 
+    if args.full_backup:
+        copy(args.zotero, backup_path(args.zotero))
+        prune_backups(args.zotero, args.keep)
 
     # open database connection
     conn = sqlite3.connect(args.zotero)
 
+    # Change detection
+    args.manifest = args.changed_only and Manifest('pusher') or None
+
+    # Annotation file lookup
+    args.docdata_index = DocdataIndex(args.okular)
+    args.docdata_index.save()
+
     # Run highlighter
-    pusher(conn, args.paths, args)
+    if pusher(conn, args.paths, args) and args.manifest is not None:
+        args.manifest.save() # Only if the changes were committed
+
+    if args.changeset is not None and pexists(args.changeset):
+        print "\nChanges saved to {}".format(args.changeset)
+        prune_backups(args.zotero, args.keep, CHANGESET_SUFFIX)
 
 ## EOF ##
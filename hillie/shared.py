@@ -5,17 +5,36 @@ All rights reserved.
 
 """
 # exports
-__all__ = ('Document', 'Annotation', 'print_note', 'list_keys', 'filter_note', 'backup_file')
+__all__ = ('Document', 'Annotation', 'FIELDS', 'note_record', 'format_note', 'print_note', 'list_keys', 'NoteFilter', 'note_filter', 'filter_note', 'backup_file', 'list_dir', 'walk_files', 'changed_files', 'parallel_map', 'print_parallel')
 
 # imports
 from basics import RX_KEY
+import cStringIO
+import copy
+import fnmatch
+import multiprocessing
+import os
+import os.path
 import shutil
+import sys
 import unicodedata
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError: # Fall back to listdir
+        scandir = None
+
+# config
+FIELDS = ('path', 'title', 'page', 'key', 'type', 'note') # Fields of a note record
+
 
 ## code ##
 
 class Document(object):
+    failed = False # Set if annotations() reported an error
     def annotations(self, options):
         abstract()
     def save(self, target, options):
@@ -29,53 +48,71 @@ class Annotation(object):
     def set_color(self, color):
         abstract()
 
-def filter_note(note, options):
-    """Process *note* text following config in *options*.
+class NoteFilter(object):
+    """Selection of notes following config in *options*.
+    Built once per run, see note_filter.
     """
-    # encoding
-    #note =  unicodedata.normalize('NFKD', note.decode('utf-8', 'ignore')).encode('ascii', 'ignore').strip()
+    def __init__(self, options):
+        self.types = frozenset(options.valid_types)
+        self.keys = frozenset(options.filter_keys)
+        self.remove_key = options.remove_key
 
-    key = ''
-    m = RX_KEY.match(note)
-    if m is not None:
-        key = m.groups()[0].strip().lower()
+    def __call__(self, note):
+        """Process *note* text. Returns (note, key) or (None, None)
+        if the note is not selected.
+        """
+        key = ''
+        m = RX_KEY.match(note)
+        if m is not None:
+            key = m.groups()[0].strip().lower()
 
-    if len(options.filter_keys): # Filter
-        if key not in options.filter_keys: # Abort
-            return None, None
-        elif 'none' not in options.filter_keys: # Abort
+        if self.keys and (key or 'none') not in self.keys: # Filter
             return None, None
 
-    if options.remove_key: # Remove key
-        m = RX_KEY.match(note)
-        if m is not None:
+        if self.remove_key and m is not None: # Remove key
             note = m.groups()[1]
 
-    if note is None or note == '':
-        return None, None
+        if note is None or note == '':
+            return None, None
 
-    return note, key
+        return note, key
 
-def print_note(note, (title, page_no), options):
-    """Prints a *note* following config in *options*.
+def note_filter(options):
+    """Return the NoteFilter of *options*, which is created on first use.
     """
-    if note is not None and note != '':
-        line = '' # Init empty
+    flt = getattr(options, 'note_filter', None)
+    if flt is None:
+        flt = options.note_filter = NoteFilter(options)
+    return flt
+
+def filter_note(note, options):
+    """Process *note* text following config in *options*.
+    """
+    return note_filter(options)(note)
 
-        if options.with_path: # Path
-            line += '{}:'.format(title)
+def note_record(item):
+    """Return the record (see FIELDS) of annotation *item*.
+    """
+    return item.path, item.title, item.page[1], item.key, item.type, item.note
 
-        if options.with_page: # Page No
-            line += '{}:'.format(page_no)
+def format_note(note, (title, page_no), options):
+    """Return the output line of *note* following config in *options*.
+    """
+    prefix = ''
+    if options.with_path: # Path
+        prefix = '{}:'.format(title)
+    if options.with_page: # Page No
+        prefix = '{}{}:'.format(prefix, page_no)
 
-        line += ' ' + note # Note
+    line = (prefix + ' ' + note).strip() # note may be unicode
+    return options.newline and line + '\n\n' or line + '\n'
 
-        # Write the note
-        line = line.strip()
-        if options.newline: line += '\n'
-        options.stdout.write(line + '\n')
-        if not options.buffered:
-            options.stdout.flush()
+def print_note(note, page, options):
+    """Prints a *note* following config in *options*.
+    Flushing is left to *options.stdout* (see sink.OutputSink).
+    """
+    if note is not None and note != '':
+        options.stdout.write(format_note(note, page, options))
 
 def list_keys(note, options):
     """Print key from note.
@@ -83,8 +120,6 @@ def list_keys(note, options):
     m = RX_KEY.match(note)
     key = m is not None and m.groups()[0].strip().lower() or 'none'
     options.stdout.write(key + '\n')
-    if not options.buffered:
-        options.stdout.flush()
 
 def backup_file(src, op=shutil.copy):
     """Create a backup of file at *src*.
@@ -101,5 +136,157 @@ def backup_file(src, op=shutil.copy):
 
     op(src, trg) # backup
 
+def walk_files(paths, recursive=False, ignore=()):
+    """Yield the files in *paths*. Directories are descended into if
+    *recursive* is set and skipped otherwise. Directory entries whose
+    name matches one of the *ignore* patterns (fnmatch-style) are skipped.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for sub in _walk_dir(path, ignore):
+                    yield sub
+            continue # Omit directories
+
+        yield path
+
+def list_dir(path):
+    """Yield (name, path, is directory) of the entries in directory *path*."""
+    if scandir is None: # Stat each entry
+        for name in os.listdir(path):
+            sub = os.path.join(path, name)
+            yield name, sub, os.path.isdir(sub)
+    else: # The file type is known from reading the directory
+        for entry in scandir(path):
+            yield entry.name, entry.path, entry.is_dir()
+
+def _walk_dir(path, ignore):
+    """Yield the files under directory *path*, recursively."""
+    for name, sub, is_dir in list_dir(path):
+        if any(fnmatch.fnmatch(name, pattern) for pattern in ignore):
+            continue
+        if is_dir:
+            for subsub in _walk_dir(sub, ignore):
+                yield subsub
+        else:
+            yield sub
+
+def parallel_map(func, items, jobs, ordered=True):
+    """Apply *func* to all *items* in a pool of *jobs* worker processes.
+
+    Results are yielded as they become available, either in the order
+    of *items* (if *ordered*) or in the order the workers complete them.
+    *func* and the items have to be picklable.
+
+    """
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = ordered and pool.imap(func, items) or pool.imap_unordered(func, items)
+        for result in results:
+            yield result
+    except: # Aborted; Don't wait for the workers
+        pool.terminate()
+        pool.join()
+        raise
+
+    # Let the workers exit normally, so they clean up (see cache.AnnotationCache)
+    pool.close()
+    pool.join()
+
+def _extract_notes((open_document, path, options)):
+    """Extract the notes of one document (in a worker process).
+    Returns the path, the note records, the error messages and the
+    counters of the annotation cache (if any).
+    """
+    options.stderr = cStringIO.StringIO()
+    try:
+        document = open_document(path, options, pgm=sys.argv[0])
+        notes = [note_record(item) for item in document.annotations(options)]
+    except Exception as err:
+        # Report instead of raising; Exceptions that cannot be pickled
+        # would otherwise stall the pool.
+        options.stderr.write('{}: {}: {}\n'.format(sys.argv[0], path, err))
+        notes = []
+
+    cache = getattr(options, 'cache', None)
+    counters = cache is not None and cache.counters() or None
+    return path, notes, options.stderr.getvalue(), counters
+
+def changed_files(files, options, docdata=None):
+    """Yield (path, signature) of the files in *files* that changed since
+    the last run, according to *options.manifest*. All files are yielded
+    (with signature None) if there's no manifest. If the annotations are
+    stored separately, *docdata* returns the path of that file, given the
+    document's path and *options*.
+    """
+    manifest = getattr(options, 'manifest', None)
+    for path in walk_files(files, options.recursive):
+        if manifest is None:
+            yield path, None
+            continue
+
+        try:
+            sources = docdata is not None and (docdata(path, options), ) or ()
+        except OSError: # Document is gone
+            sources = ()
+        signature = manifest.check(path, *sources)
+        if signature is not None:
+            yield path, signature
+
+def print_parallel(open_document, files, options, docdata=None):
+    """Print notes from *files*, parsed in *options.jobs* worker processes.
+
+    Documents are opened by calling *open_document* (usually a Document
+    class) with the path, options and program name. Notes of a document
+    are written to *options.writer* together, so the output is grouped
+    by file as in serial mode. Documents are printed in input order if
+    *options.ordered* is set and as they are completed otherwise. Error
+    messages from the workers are passed on to *options.stderr*. With
+    *options.manifest*, only documents that changed since the last run or
+    failed are parsed. If given, *docdata* maps documents to their
+    annotation files (see changed_files), which the workers then open
+    instead.
+
+    """
+    if options.list_keys:
+        options.remove_key = False
+
+    # Workers get a copy of the options without the (unpicklable) streams
+    # and writer, the docdata index (annotation files are resolved here
+    # instead) and the manifest (documents are recorded here)
+    wopts = copy.copy(options)
+    wopts.stdout = wopts.stderr = wopts.writer = None
+    wopts.docdata_index = wopts.manifest = None
+
+    cache = getattr(options, 'cache', None)
+    manifest = getattr(options, 'manifest', None)
+    signatures = {}
+    def jobs():
+        for path, signature in changed_files(files, options, docdata):
+            try:
+                target = docdata is not None and docdata(path, options) or path
+            except OSError: # Document is gone, let the worker report it
+                target = path
+            signatures[target] = path, signature
+            yield open_document, target, wopts
+
+    for target, notes, errors, counters in parallel_map(_extract_notes, jobs(), options.jobs, options.ordered):
+        if errors != '':
+            options.stderr.write(errors)
+            if not options.buffered:
+                options.stderr.flush()
+
+        if counters is not None:
+            cache.add_counters(counters)
+
+        for rec in notes:
+            if options.list_keys:
+                list_keys(rec[-1], options)
+            else:
+                options.writer.write(rec)
+        options.stdout.tick() # Don't hold back notes while waiting for the workers
+
+        if manifest is not None and errors == '': # Retry failed documents next time
+            manifest.record(*signatures[target])
 
 ## EOF ##
@@ -0,0 +1,94 @@
+"""Buffered output streams.
+
+An output sink collects what is written to it and passes it on to the
+underlying stream in large chunks, once BUFFER_SIZE bytes are pending or
+FLUSH_INTERVAL seconds passed since the last write to the stream. The
+interval is checked on each write and whenever the program calls tick()
+(e.g. after each document), so output is held back at most until the
+next call. With a buffer size of zero, everything is written right away
+(line buffering).
+
+If the reader of the stream goes away (e.g. when piped into head),
+BrokenPipe is raised, so the program can stop quietly.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('BrokenPipe', 'OutputSink', 'NullSink', 'BUFFER_SIZE')
+
+# imports
+import errno
+import os
+import time
+
+# config
+BUFFER_SIZE = 64 * 1024 # Bytes collected before writing to the stream
+FLUSH_INTERVAL = 1.0 # Maximum seconds pending output is held back
+
+
+## code ##
+
+class BrokenPipe(Exception): pass
+
+class OutputSink(object):
+    """Buffered writing to *stream*.
+    """
+    def __init__(self, stream, buffer_size=BUFFER_SIZE, interval=FLUSH_INTERVAL):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self._chunk = []
+        self._size = 0
+        self._last = time.time()
+
+    def write(self, data):
+        """Write *data*. Unicode is encoded as utf-8."""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._chunk.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size or time.time() - self._last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Write the pending output to the stream."""
+        try:
+            if len(self._chunk):
+                self.stream.write(''.join(self._chunk))
+                self._chunk, self._size = [], 0
+            self.stream.flush()
+        except IOError as err:
+            if err.errno != errno.EPIPE:
+                raise
+            # Drop the output, also what the stream still buffers
+            self._chunk, self._size = [], 0
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.stream.fileno())
+            os.close(devnull)
+            raise BrokenPipe()
+        self._last = time.time()
+
+    def tick(self):
+        """Write the pending output if FLUSH_INTERVAL passed."""
+        if len(self._chunk) and time.time() - self._last >= self.interval:
+            self.flush()
+
+    def close(self):
+        """Write all pending output."""
+        self.flush()
+
+class NullSink(OutputSink):
+    """Discards all output.
+    """
+    def __init__(self):
+        super(NullSink, self).__init__(None)
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+## EOF ##
@@ -0,0 +1,135 @@
+"""Precompiled, memory-mapped word lists.
+
+A word table stores a sorted list of words in a single binary file,
+together with a hash index over them. The file is opened with mmap and
+queried in place, so no Python object is created per word at load time.
+
+File layout (all integers little endian):
+
+    header  magic, count, slots, source size, source mtime
+    index   *slots* uint32 offsets into the blob (0 marks an empty slot)
+    blob    the sorted words, each terminated by a newline
+
+The index uses open addressing with linear probing over crc32 hashes.
+Source size and mtime identify the word list the table was built from
+and are used to detect stale tables.
+
+Copyright (c) 2016, Matthias Baumgartner
+All rights reserved.
+
+"""
+# EXPORTS
+__all__ = ('WordTable', )
+
+# IMPORTS
+import mmap
+import os
+import os.path
+import struct
+import tempfile
+import zlib
+
+## CONFIGURATION ##
+
+MAGIC = 'HWT1'
+HEADER = struct.Struct('<4sIIQQ')
+SLOT = struct.Struct('<I')
+
+## CODE ##
+
+def _fingerprint(path):
+    """Return (size, mtime) of *path* or (0, 0) if it doesn't exist."""
+    if path is None or not os.path.exists(path):
+        return 0, 0
+    st = os.stat(path)
+    return st.st_size, int(st.st_mtime)
+
+def _hash(word):
+    return zlib.crc32(word) & 0xffffffff
+
+class WordTable(object):
+    """Read-only set of words backed by a memory-mapped table file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as ifile:
+            self._map = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, self._slots, size, mtime = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise IOError('{}: not a word table'.format(path))
+        self.source = (size, mtime)
+        self._mask = self._slots - 1
+        self._index = HEADER.size
+        self._blob = HEADER.size + SLOT.size * self._slots
+
+    @staticmethod
+    def build(words, path, source=None):
+        """Write the *words* to a table file at *path*.
+        *source* is the word list the table is derived from (for staleness checks).
+        """
+        words = sorted(set(w for w in words if w != ''))
+        slots = 1
+        while slots < 2 * len(words):
+            slots *= 2
+
+        # Blob offsets are relative to the blob start, shifted by one (0 is empty)
+        index = [0] * slots
+        blob = []
+        offset = 1
+        for word in words:
+            pos = _hash(word) & (slots - 1)
+            while index[pos] != 0:
+                pos = (pos + 1) & (slots - 1)
+            index[pos] = offset
+            blob.append(word)
+            offset += len(word) + 1
+
+        size, mtime = _fingerprint(source)
+
+        # Write to a temporary file first, so readers never see partial tables
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'wb') as ofile:
+            ofile.write(HEADER.pack(MAGIC, len(words), slots, size, mtime))
+            ofile.write(struct.pack('<{}I'.format(slots), *index))
+            for word in blob:
+                ofile.write(word + '\n')
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+
+    def is_stale(self, source):
+        """Return True if the table was not built from the current *source* file."""
+        return self.source != _fingerprint(source)
+
+    def __contains__(self, word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+
+        pos = _hash(word) & self._mask
+        while True:
+            offset = SLOT.unpack_from(self._map, self._index + SLOT.size * pos)[0]
+            if offset == 0: # Empty slot, word not in table
+                return False
+
+            start = self._blob + offset - 1
+            end = start + len(word)
+            if self._map[start:end] == word and self._map[end] == '\n':
+                return True
+
+            pos = (pos + 1) & self._mask
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Iterate over all words in sorted order."""
+        start = self._blob
+        while start < len(self._map):
+            end = self._map.find('\n', start)
+            yield self._map[start:end]
+            start = end + 1
+
+    def close(self):
+        self._map.close()
+
+## EOF ##
@@ -0,0 +1,105 @@
+"""Output formats for note records.
+
+A writer turns note records (see shared.FIELDS) into lines of one of
+the output formats and passes them on to the output stream.
+
+* text      "title:page: note", following the display options (default)
+* jsonl     One JSON object per line
+* tsv       Tab-separated values with a header line; tabs, newlines and
+            backslashes in values are escaped as \\t, \\n and \\\\
+* null      Each value terminated by a NUL byte (like find -print0)
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# exports
+__all__ = ('FORMATS', 'Writer', 'TextWriter', 'JsonlWriter', 'TsvWriter', 'NullWriter', 'make_writer')
+
+# imports
+from collections import OrderedDict
+from shared import FIELDS, format_note
+import json
+
+# config
+TSV_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+
+## code ##
+
+def _encode(value):
+    """Return *value* as utf-8 byte string. None is an empty string."""
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class Writer(object):
+    """Write note records to *options.stdout*, usually an OutputSink.
+    """
+    def __init__(self, options):
+        self.stream = options.stdout
+
+    def format(self, record):
+        abstract()
+
+    def write(self, record):
+        """Write the note *record*."""
+        self.stream.write(self.format(record))
+
+    def close(self):
+        """Write all remaining output."""
+        self.stream.flush()
+
+class TextWriter(Writer):
+    """Plain text, as printed by print_note."""
+    def __init__(self, options):
+        super(TextWriter, self).__init__(options)
+        self.options = options
+
+    def format(self, (path, title, page, key, type_, note)):
+        title = self.options.use_title and title or path
+        return _encode(format_note(note, (title, page), self.options))
+
+class JsonlWriter(Writer):
+    """One JSON object per line."""
+    def format(self, record):
+        return json.dumps(OrderedDict(zip(FIELDS, record))) + '\n'
+
+class TsvWriter(Writer):
+    """Tab-separated values, starting with a header line."""
+    def __init__(self, options):
+        super(TsvWriter, self).__init__(options)
+        self._header = True
+
+    def format(self, record):
+        values = []
+        for value in record:
+            value = _encode(value)
+            for char, escape in TSV_ESCAPES:
+                value = value.replace(char, escape)
+            values.append(value)
+        line = '\t'.join(values) + '\n'
+
+        if self._header: # Before the first record
+            line, self._header = '\t'.join(FIELDS) + '\n' + line, False
+        return line
+
+class NullWriter(Writer):
+    """Values terminated by NUL; a record consists of len(FIELDS) values."""
+    def format(self, record):
+        return ''.join(_encode(value) + '\0' for value in record)
+
+FORMATS = OrderedDict((
+    ('text', TextWriter),
+    ('jsonl', JsonlWriter),
+    ('tsv', TsvWriter),
+    ('null', NullWriter),
+    ))
+
+def make_writer(options):
+    """Return the writer of *options.format*."""
+    return FORMATS[options.format](options)
+
+## EOF ##
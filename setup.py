@@ -11,9 +11,9 @@ setup(
     packages=['hillie'],
     package_data = {
         '': ['README.md'],
-        'hillie': ['data/collected-words', 'data/stems.t', 'data/words.t']
+        'hillie': ['data/collected-words', 'data/stems.t', 'data/words.t', 'data/*.tbl']
         },
-    scripts = ['anedit', 'hillie-p', 'hillie-o', 'pusher'],
+    scripts = ['anedit', 'hillie-p', 'hillie-o', 'hillie-index', 'hillie-search', 'pusher'],
     license='Free for use',
     requires=('lxml', 'stemming', 'levenshtein', 're', 'urllib', 'poppler', 'glib', 'magic', 'sqlite3')
 )
@@ -0,0 +1,12 @@
+"""Tests. Run with python -m unittest discover -s tests -t .
+
+The modules of hillie import each other by name, so the package
+directory is put on the path.
+
+"""
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hillie'))
+
+## EOF ##
@@ -0,0 +1,72 @@
+"""Tests of hillie-o.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# imports
+from hillieo import okular_highlights
+from manifest import Manifest
+from sink import OutputSink
+from writers import make_writer
+import argparse
+import cStringIO
+import os.path
+import shutil
+import tempfile
+import unittest
+
+# config
+GOOD = """<?xml version="1.0" encoding="utf-8"?>
+<documentInfo url="/nowhere/good.pdf"><pageList><page number="0"><annotationList>
+<annotation type="4"><base contents="&lt;how&gt;a note&lt;/how&gt;"/><hl/></annotation>
+</annotationList></page></pageList></documentInfo>
+"""
+BROKEN = """<documentInfo><pageList><page"""
+
+
+## code ##
+
+class TestChangedOnly(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.okular = os.path.join(self.tmp, 'docdata')
+        os.mkdir(self.okular)
+        self.good = os.path.join(self.okular, '10.good.pdf.xml')
+        self.broken = os.path.join(self.okular, '10.broken.pdf.xml')
+        with open(self.good, 'w') as ofile:
+            ofile.write(GOOD)
+        with open(self.broken, 'w') as ofile:
+            ofile.write(BROKEN)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_hillieo(self):
+        options = argparse.Namespace(
+            recursive=False, use_title=False, valid_types=['1', '4'], filter_keys=[],
+            remove_key=False, with_path=True, with_page=False, newline=False,
+            buffered=True, list_keys=False, jobs=1, ordered=True, format='text',
+            okular=self.okular, docdata_index=None,
+            manifest=Manifest('test', self.tmp),
+            stdout=OutputSink(cStringIO.StringIO()), stderr=cStringIO.StringIO())
+        options.writer = make_writer(options)
+        okular_highlights([self.good, self.broken], options)
+        options.writer.close()
+        options.manifest.save()
+        return options.stdout.stream.getvalue(), options.stderr.getvalue()
+
+    def test_failed_document_is_retried(self):
+        output, errors = self.run_hillieo()
+        self.assertEqual(output, '{}: <how>a note</how>\n'.format(self.good))
+        self.assertIn(self.broken, errors)
+
+        # The good document is skipped, the broken one read again
+        output, errors = self.run_hillieo()
+        self.assertEqual(output, '')
+        self.assertIn(self.broken, errors)
+
+if __name__ == '__main__':
+    unittest.main()
+
+## EOF ##
@@ -0,0 +1,39 @@
+"""Tests of the annotation normalizer.
+
+Copyright (c) 2018, Matthias Baumgartner
+All rights reserved.
+
+"""
+# imports
+from normalizer import annotation_fixes, shared_dictionary
+import unittest
+
+
+## code ##
+
+class TestAnnotationFixes(unittest.TestCase):
+    def test_long_inflected_words(self):
+        # check() accepts inflected forms longer than any dictionary entry
+        for text in ('the responsibilities are high', 'characteristically slow'):
+            self.assertEqual(annotation_fixes(text), text)
+
+    def test_ambiguous_glued_words(self):
+        # Several best segmentations; Left alone
+        for text in ('theresponsibilities', 'characteristicallyslow'):
+            self.assertEqual(annotation_fixes(text), text)
+
+    def test_glued_words(self):
+        self.assertEqual(annotation_fixes('the responsibilitiesofmanagers are high'),
+                         'the responsibilities of managers are high')
+        self.assertEqual(annotation_fixes('helloworld'), 'hello world')
+
+    def test_segment(self):
+        words = shared_dictionary()
+        self.assertEqual(words.segment('helloworldmodel'), ['hello', 'world', 'model'])
+        self.assertEqual(words.segment('theresponsibilities'), []) # Not unique
+        self.assertIsNone(words.segment('xqzxqz'))
+
+if __name__ == '__main__':
+    unittest.main()
+
+## EOF ##